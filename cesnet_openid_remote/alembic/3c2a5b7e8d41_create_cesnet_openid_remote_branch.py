@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Create cesnet_openid_remote branch."""
+
+# revision identifiers, used by Alembic.
+revision = "3c2a5b7e8d41"
+down_revision = None
+branch_labels = ("cesnet_openid_remote",)
+depends_on = "dbdbc1b19cf2"
+
+
+def upgrade():
+    """Upgrade database."""
+    pass
+
+
+def downgrade():
+    """Downgrade database."""
+    pass
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Create user aai group table."""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d8b0c3f7a12"
+down_revision = "9e1f4d6a2b07"
+branch_labels = ()
+depends_on = "9848d0149abd"
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        "cesnet_user_aai_group",
+        sa.Column("aai_group", sa.String(length=255), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["accounts_user.id"],
+            name=op.f("fk_cesnet_user_aai_group_user_id_accounts_user"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint(
+            "aai_group", "user_id", name=op.f("pk_cesnet_user_aai_group")
+        ),
+    )
+    op.create_index(
+        op.f("ix_cesnet_user_aai_group_user_id"),
+        "cesnet_user_aai_group",
+        ["user_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_index(
+        op.f("ix_cesnet_user_aai_group_user_id"), table_name="cesnet_user_aai_group"
+    )
+    op.drop_table("cesnet_user_aai_group")
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Create aai group mapping table."""
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9e1f4d6a2b07"
+down_revision = "3c2a5b7e8d41"
+branch_labels = ()
+depends_on = "de9c14cbb0b2"
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        "cesnet_aai_group_mapping",
+        sa.Column("aai_group", sa.String(length=255), nullable=False),
+        sa.Column(
+            "community_id", sqlalchemy_utils.types.uuid.UUIDType(), nullable=False
+        ),
+        sa.Column("role", sa.String(length=50), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["community_id"],
+            ["communities_metadata.id"],
+            name=op.f("fk_cesnet_aai_group_mapping_community_id_communities_metadata"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint(
+            "aai_group",
+            "community_id",
+            "role",
+            name=op.f("pk_cesnet_aai_group_mapping"),
+        ),
+    )
+    op.create_index(
+        op.f("ix_cesnet_aai_group_mapping_community_id"),
+        "cesnet_aai_group_mapping",
+        ["community_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_index(
+        op.f("ix_cesnet_aai_group_mapping_community_id"),
+        table_name="cesnet_aai_group_mapping",
+    )
+    op.drop_table("cesnet_aai_group_mapping")
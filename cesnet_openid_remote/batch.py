@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Planning of membership syncs of many users at once with sparse matrices.
+
+Requires the ``batch`` extra (``numpy`` and ``scipy``). The plans are the
+same as :func:`cesnet_openid_remote.communities.plan_user_sync` returns for
+each user, only the order of the changes may differ.
+"""
+
+from collections import defaultdict
+from collections.abc import Sequence
+from itertools import chain, count, islice
+
+import numpy as np
+from scipy import sparse
+
+from .communities import SyncPlan
+from .proxies import current_cesnet_openid
+from .reconcile import get_users_community_roles
+
+
+def _factorize():
+    """Return a dict numbering the keys in the order they are first looked up."""
+    return defaultdict(count().__next__)
+
+
+def _lengths(items):
+    return np.fromiter(map(len, items), dtype=np.int64, count=len(items))
+
+
+def _codes(keys, items, n):
+    """Return the numbers of the ``n`` items, see :func:`_factorize`."""
+    return np.fromiter(map(keys.__getitem__, items), dtype=np.int64, count=n)
+
+
+def _matrix(rows, cols, shape):
+    """Return a boolean (0/1) CSR matrix with ones at the coordinates."""
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape
+    )
+    # duplicate coordinates are summed up
+    matrix.data[:] = 1
+    return matrix
+
+
+def _rows_matrix(lengths, cols, n_cols):
+    """Return a boolean CSR matrix of rows with ``lengths`` distinct columns."""
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.int32), cols, indptr),
+        shape=(len(lengths), n_cols),
+    )
+
+
+def _binary(matrix):
+    matrix = matrix.tocsr().astype(np.int32)
+    matrix.eliminate_zeros()
+    matrix.data[:] = 1
+    return matrix
+
+
+def _minus(a, b):
+    """Return ``a and not b`` of boolean matrices."""
+    return _binary(a - a.multiply(b))
+
+
+def _row_slices(matrix, keys):
+    """Return the keys of the non-zero columns and the row offsets."""
+    matrix = matrix.tocsr()
+    matrix.sort_indices()
+    return list(map(keys.__getitem__, matrix.indices.tolist())), matrix.indptr.tolist()
+
+
+class BatchSyncPlans(Sequence):
+    """Plans of a batch of users, a :class:`SyncPlan` is created on access."""
+
+    def __init__(self, add, remove, conflicts):
+        """Constructor, the arguments are returned by :func:`_row_slices`."""
+        self._add, self._add_ptr = add
+        self._remove, self._remove_ptr = remove
+        self._conflicts, self._conflicts_ptr = conflicts
+
+    def __len__(self):
+        """Return the number of users."""
+        return len(self._add_ptr) - 1
+
+    def __getitem__(self, user):
+        """Return the plan of the user."""
+        if not 0 <= user < len(self._add_ptr) - 1:
+            raise IndexError(user)
+        return self._plan(
+            *self._add_ptr[user : user + 2],
+            *self._remove_ptr[user : user + 2],
+            *self._conflicts_ptr[user : user + 2],
+        )
+
+    def __iter__(self):
+        """Return the plans of the users in order."""
+        return map(
+            self._plan,
+            self._add_ptr,
+            islice(self._add_ptr, 1, None),
+            self._remove_ptr,
+            islice(self._remove_ptr, 1, None),
+            self._conflicts_ptr,
+            islice(self._conflicts_ptr, 1, None),
+        )
+
+    def _plan(self, add_start, add_end, remove_start, remove_end, start, end):
+        conflicts = {}
+        if start != end:
+            for community_id, role in self._conflicts[start:end]:
+                conflicts.setdefault(community_id, set()).add(role)
+        return SyncPlan(
+            self._add[add_start:add_end],
+            self._remove[remove_start:remove_end],
+            conflicts,
+        )
+
+
+def plan_batch_sync(users_groups, users_community_roles, matcher):
+    """Return the :class:`SyncPlan` of each user as :class:`BatchSyncPlans`.
+
+    :param users_groups: Perun groups of each user.
+    :param users_community_roles: ``{community_id: {roles}}`` of each user.
+    :param matcher: :class:`cesnet_openid_remote.patterns.GroupMatcher` with
+        ``(community_id, role)`` values.
+
+    Users x groups (``U``) and groups x (community, role) pairs (``M``) are
+    encoded as sparse boolean matrices, the target memberships are ``U @ M``.
+    Per community, the target and current pairs are summed by the pairs x
+    communities matrix ``P``. A community with more than one target role is a
+    conflict, a community with a current role not in the target is removed
+    (and its target role added again), other target pairs not held yet are
+    added.
+    """
+    n_users = len(users_groups)
+    groups, communities, roles = _factorize(), _factorize(), _factorize()
+
+    # each group, community and role is numbered once, the users' items are
+    # turned into numbers in a single pass
+    group_lengths = _lengths(users_groups)
+    user_groups = _codes(
+        groups, chain.from_iterable(users_groups), int(group_lengths.sum())
+    )
+    community_lengths = _lengths(users_community_roles)
+    user_communities = _codes(
+        communities,
+        chain.from_iterable(users_community_roles),
+        int(community_lengths.sum()),
+    )
+    users_roles = list(chain.from_iterable(map(dict.values, users_community_roles)))
+    role_lengths = _lengths(users_roles)
+    user_roles = _codes(
+        roles, chain.from_iterable(users_roles), int(role_lengths.sum())
+    )
+
+    mapping_rows, mapping_communities, mapping_roles = [], [], []
+    for group_number, aai_group in enumerate(list(groups)):
+        for community_id, role in matcher.match_group(aai_group):
+            mapping_rows.append(group_number)
+            mapping_communities.append(communities[community_id])
+            mapping_roles.append(roles[role])
+
+    # a (community, role) pair is numbered by community * n_roles + role
+    n_roles = max(len(roles), 1)
+    pair_codes, pair_numbers = np.unique(
+        np.concatenate(
+            [
+                np.repeat(user_communities, role_lengths) * n_roles + user_roles,
+                np.array(mapping_communities, dtype=np.int64) * n_roles
+                + np.array(mapping_roles, dtype=np.int64),
+            ]
+        ),
+        return_inverse=True,
+    )
+    n_user_pairs = len(user_roles)
+    community_keys, role_keys = list(communities), list(roles)
+    pair_communities = pair_codes // n_roles
+    pair_keys = [
+        (community_keys[community], role_keys[role])
+        for community, role in zip(
+            pair_communities.tolist(), (pair_codes % n_roles).tolist()
+        )
+    ]
+
+    n_groups, n_pairs, n_communities = len(groups), len(pair_codes), len(communities)
+    U = _rows_matrix(group_lengths, user_groups, n_groups)
+    pair_lengths = np.bincount(
+        np.repeat(np.arange(n_users), community_lengths),
+        weights=role_lengths,
+        minlength=n_users,
+    ).astype(np.int64)
+    C = _rows_matrix(pair_lengths, pair_numbers[:n_user_pairs], n_pairs)
+    M = _matrix(mapping_rows, pair_numbers[n_user_pairs:], (n_groups, n_pairs))
+    P = _matrix(np.arange(n_pairs), pair_communities, (n_pairs, n_communities))
+
+    T = _binary(U @ M)
+    conflicts = _binary((T @ P) > 1)
+    conflict_pairs = _binary(conflicts @ P.T)
+    removed = _minus(_binary(_minus(C, T) @ P), conflicts)
+    target = _minus(T, conflict_pairs)
+    kept = _minus(target.multiply(C), _binary(removed @ P.T))
+    added = _minus(target, kept)
+
+    return BatchSyncPlans(
+        _row_slices(added, pair_keys),
+        _row_slices(removed, community_keys),
+        _row_slices(T.multiply(conflict_pairs), pair_keys),
+    )
+
+
+def plan_users_sync_batch(identities, entitlements):
+    """Yield ``(identity, plan)`` for the identities, planned at once.
+
+    Same as :func:`cesnet_openid_remote.reconcile.plan_users_sync`.
+    """
+    identities = list(identities)
+    current_roles = get_users_community_roles([i.id_user for i in identities])
+    plans = plan_batch_sync(
+        [set(entitlements[identity.id]) for identity in identities],
+        [current_roles.get(identity.id_user, {}) for identity in identities],
+        current_cesnet_openid.mapping_index.get_matcher(),
+    )
+    yield from zip(identities, plans)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Circuit breaker guarding the calls to the Perun userinfo endpoint."""
+
+import threading
+import time
+
+from flask import current_app
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling an unavailable service for a while.
+
+    After ``OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_THRESHOLD`` consecutive
+    failures the circuit opens and no calls are allowed. After
+    ``OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_RESET_TIMEOUT`` seconds a
+    single trial call is allowed (half open); its success closes the circuit,
+    its failure opens it again. A trial call that does not report its result
+    within the timeout is replaced by another one. The state is reported to
+    the metrics sink as the ``<name>_circuit_open`` gauge.
+    """
+
+    def __init__(self, name, clock=time.monotonic):
+        """Constructor."""
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            reset_timeout = current_app.config[
+                "OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_RESET_TIMEOUT"
+            ]
+            if self._clock() - self._opened_at >= reset_timeout:
+                # let a single call through to probe the service, or another
+                # one if the previous probe never reported its result
+                self._opened_at = self._clock()
+                if self.state == OPEN:
+                    self._set_state(HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        """Record a successful call."""
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        """Record a failed call."""
+        with self._lock:
+            self.failures += 1
+            threshold = current_app.config[
+                "OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_THRESHOLD"
+            ]
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= threshold
+            ):
+                self._opened_at = self._clock()
+                self._set_state(OPEN)
+
+    def _set_state(self, state):
+        from .proxies import current_cesnet_openid
+
+        self.state = state
+        current_cesnet_openid.metrics_sink.set_gauge(
+            f"{self.name}_circuit_open", int(state != CLOSED)
+        )
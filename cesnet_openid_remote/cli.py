@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""CLI commands for CESNET-OpenID-Remote."""
+
+import click
+from flask.cli import with_appcontext
+from invenio_accounts.models import User
+from invenio_db import db
+from invenio_oauthclient.models import RemoteAccount
+
+from .mapping import invalidate_mapping_index, load_community_mappings
+from .models import AAIGroupMapping
+from .reconcile import Checkpoint, read_export, reconcile_export
+from .sync import reset_fingerprint
+
+
+@click.group("cesnet:mapping")
+def mapping():
+    """Management commands for the CESNET aai_mapping table."""
+
+
+@mapping.command("rebuild")
+@with_appcontext
+def rebuild_mapping():
+    """Rebuild the mapping table from the communities' aai_mapping."""
+    AAIGroupMapping.query.delete(synchronize_session=False)
+    count = 0
+    for community_id, community_mapping in load_community_mappings():
+        AAIGroupMapping.set_community_mapping(community_id, community_mapping)
+        count += 1
+    db.session.commit()
+    invalidate_mapping_index()
+    click.secho(f"Stored aai_mapping of {count} communities.", fg="green")
+
+
+@click.group("cesnet:user")
+def user():
+    """Management commands for users logging in with CESNET."""
+
+
+@user.command("resync")
+@click.argument("emails", nargs=-1)
+@click.option("--all", "all_users", is_flag=True, help="Resync all users.")
+@with_appcontext
+def resync_user(emails, all_users):
+    """Run a full Perun group sync on the next login of the users."""
+    if not emails and not all_users:
+        raise click.UsageError("Give some emails or --all.")
+
+    query = RemoteAccount.query
+    if not all_users:
+        query = query.join(User).filter(User.email.in_(emails))
+
+    count = 0
+    for remote_account in query:
+        reset_fingerprint(remote_account)
+        count += 1
+    db.session.commit()
+    click.secho(f"{count} accounts will be resynced on next login.", fg="green")
+
+
+@click.command("cesnet:sync")
+@click.argument("export", type=click.File("r"))
+@click.option(
+    "--format",
+    "export_format",
+    type=click.Choice(["jsonl", "csv"]),
+    default="jsonl",
+    show_default=True,
+    help="Format of the sub -> eduperson_entitlement export.",
+)
+@click.option(
+    "--method",
+    default="perun",
+    show_default=True,
+    help="External method of the users' identities.",
+)
+@click.option("--chunk-size", default=500, show_default=True)
+@click.option(
+    "--engine",
+    type=click.Choice(["python", "batch"]),
+    default="python",
+    show_default=True,
+    help="Plan user by user, or whole chunks at once (requires the batch extra).",
+)
+@click.option("--processes", default=1, show_default=True)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="File to resume from and to store the progress to.",
+)
+@with_appcontext
+def sync(export, export_format, method, chunk_size, engine, processes, checkpoint):
+    """Sync community memberships of all users in a Perun export."""
+    stats = reconcile_export(
+        read_export(export, export_format),
+        method=method,
+        chunk_size=chunk_size,
+        processes=processes,
+        checkpoint=Checkpoint(checkpoint),
+        engine=engine,
+    )
+    elapsed = stats["elapsed"] or 1e-9
+    click.echo(
+        f"Users: {stats['users']} ({stats['users'] / elapsed:.1f} users/s), "
+        f"unknown: {stats['unknown']}, failures: {stats['failures']}"
+    )
+    click.echo(
+        f"Memberships added: {stats['added']}, removed: {stats['removed']}, "
+        f"elapsed: {elapsed:.1f} s"
+    )
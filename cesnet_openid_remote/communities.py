@@ -1,67 +1,149 @@
 from collections import defaultdict
-from typing import Dict, Set
+from functools import partial
+from typing import Dict, List, NamedTuple, Set, Tuple
 
-from flask import abort
+import requests
+from flask import abort, current_app
+from flask_oauthlib.client import OAuthException
 from invenio_access.permissions import system_identity
 from invenio_communities import current_communities
+from invenio_communities.members.records.models import MemberModel
+from invenio_db import db
 from invenio_oauthclient.handlers.utils import token_getter
+from invenio_oauthclient.models import RemoteAccount
 from invenio_oauthclient.utils import oauth_get_user
-from invenio_search.engine import dsl
 
+from cesnet_openid_remote.errors import EntitlementsUnavailable
+from cesnet_openid_remote.mapping import query_mapped_communities
+from cesnet_openid_remote.metrics import count, phase, timed
+from cesnet_openid_remote.models import UserAAIGroup
+from cesnet_openid_remote.patterns import is_group_pattern, pattern_matches
+from cesnet_openid_remote.profiling import profiled, tag_profile
+from cesnet_openid_remote.proxies import current_cesnet_openid
+from cesnet_openid_remote.sync import (
+    has_fingerprint,
+    is_synced,
+    store_fingerprint,
+    sync_fingerprint,
+)
+from cesnet_openid_remote.tokens import decode_id_token
+from cesnet_openid_remote.uow import BulkIndexUnitOfWork
+from cesnet_openid_remote.utils import submit_in_context
 
+
+class SyncPlan(NamedTuple):
+    """Membership changes needed to sync a user with their Perun groups."""
+
+    add: List[Tuple[str, str]]
+    """``(community_id, role)`` memberships to add."""
+
+    remove: List[str]
+    """Communities to remove the user from (before adding)."""
+
+    conflicts: Dict[str, Set[str]]
+    """Communities where the user would get more than one role."""
+
+
+@timed("get_user_community_roles")
 def get_user_community_roles(user) -> Dict[str, Set[str]]:
-    members_service = current_communities.service.members
-    search = members_service._search(
-        "search",
-        system_identity,
-        {},
-        None,
-        extra_filter=dsl.Q("term", **{"user.id": str(user.id)}),
+    # read the members table, the search index is paginated and may lag behind
+    count("db_queries")
+    memberships = (
+        db.session.query(MemberModel.community_id, MemberModel.role)
+        .filter(MemberModel.user_id == user.id, MemberModel.active.is_(True))
+        .yield_per(500)
     )
-
-    result = search.execute()
     ret = defaultdict(set)
-    for hit in result:
-        ret[hit["community_id"]].add(hit["role"])
+    for community_id, role in memberships:
+        ret[str(community_id)].add(role)
     return ret
 
 
-def get_user_perun_groups(remote):
-    user_info = remote.get(f"{remote.base_url}userinfo")
+@timed("get_user_perun_groups")
+def get_user_perun_groups(remote, sub=None, claims=None):
+    source = current_app.config["OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_SOURCE"]
+    if source != "userinfo":
+        if claims is not None and "eduperson_entitlement" in claims:
+            return set(claims["eduperson_entitlement"])
+        if source == "id_token":
+            # an empty set would remove all the user's memberships, none are
+            # removed instead, see OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_SOURCE
+            current_app.logger.warning(
+                "The id_token has no eduperson_entitlement claim, memberships of "
+                "the user are not removed."
+            )
+            raise EntitlementsUnavailable(
+                "The id_token has no eduperson_entitlement claim"
+            )
+
+    cache = current_cesnet_openid.entitlement_cache
+    if sub is not None and cache is not None:
+        perun_groups = cache.get(sub)
+        if perun_groups is not None:
+            return perun_groups
+
+    breaker = current_cesnet_openid.userinfo_breaker
+    if not breaker.allow():
+        raise EntitlementsUnavailable("Perun userinfo circuit is open")
+
+    count("http_calls")
     try:
-        return set(user_info.data["eduperson_entitlement"])
-    except (AttributeError, KeyError):
-        return set()
+        user_info = remote.get(f"{remote.base_url}userinfo")
+    except requests.RequestException as e:
+        breaker.record_failure()
+        raise EntitlementsUnavailable(str(e)) from e
+    except OAuthException as e:
+        # the user's token is missing, Perun itself is fine
+        raise EntitlementsUnavailable(str(e)) from e
+    status = getattr(user_info, "status", None)
+    if isinstance(status, int) and status >= 500:
+        breaker.record_failure()
+        raise EntitlementsUnavailable(f"Perun userinfo failed with status {status}")
+    # Perun has answered, an error of the user's token does not open the circuit
+    breaker.record_success()
+    data = getattr(user_info, "data", None)
+    if not isinstance(data, dict) or "error" in data:
+        raise EntitlementsUnavailable(f"Invalid Perun userinfo response: {data!r}")
+
+    perun_groups = set(data.get("eduperson_entitlement", ()))
+    if sub is not None and cache is not None:
+        cache.set(sub, perun_groups)
+    return perun_groups
 
 
-def add_user_community_membership(community_id, community_role, user):
+def add_user_community_membership(community_id, community_role, user, uow=None):
     data = {
         "role": community_role,
         "members": [{"type": "user", "id": str(user.id)}],
     }
-    current_communities.service.members.add(system_identity, community_id, data)
+    current_communities.service.members.add(
+        system_identity, community_id, data, uow=uow
+    )
 
 
+@timed("get_mapped_communities")
 def get_mapped_communities(perun_groups):
-    communities = current_communities.service.scan(
-        system_identity, params={"facets": {"aai_mapping_group": perun_groups}}
-    )
-    return {
-        community["id"]: community["custom_fields"]["aai_mapping"]
-        for community in communities
-    }
+    if current_app.config["OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX"]:
+        return current_cesnet_openid.mapping_index.lookup(perun_groups)
+    return query_mapped_communities(perun_groups)
 
 
-def remove_user_community_membership(community_id, user):
+def remove_user_community_membership(community_id, user, uow=None):
     data = {"members": [{"type": "user", "id": str(user.id)}]}
-    current_communities.service.members.delete(system_identity, community_id, data)
+    current_communities.service.members.delete(
+        system_identity, community_id, data, uow=uow
+    )
 
 
 def split_user_roles(mapping, current_roles, perun_groups):
     kept_roles = set()
     added_roles = set()
     for entry in mapping:
-        if entry["aai_group"] in perun_groups:
+        aai_group = entry["aai_group"]
+        if aai_group in perun_groups or (
+            is_group_pattern(aai_group)
+            and any(pattern_matches(aai_group, group) for group in perun_groups)
+        ):
             role = entry["role"]
             if role not in current_roles:
                 added_roles.add(role)
@@ -71,7 +153,7 @@ def split_user_roles(mapping, current_roles, perun_groups):
     return kept_roles, added_roles, removed_roles
 
 
-def account_info_link_perun_groups(remote, *, account_info, **kwargs):
+def account_info_link_perun_groups(remote, *, account_info, response=None, **kwargs):
     user = oauth_get_user(
         remote.consumer_key,
         account_info=account_info,
@@ -79,29 +161,175 @@ def account_info_link_perun_groups(remote, *, account_info, **kwargs):
     )
 
     if user is not None:
-        return link_perun_groups(remote, user)
+        # already verified and memoized by account_info_serializer
+        claims = decode_id_token(remote, response) if response else None
+        return link_perun_groups(
+            remote, user, sub=account_info.get("external_id"), claims=claims
+        )
+
+
+@profiled
+def link_perun_groups(remote, user, sub=None, claims=None, force=False):
+    return current_cesnet_openid.sync_coordinator.run(
+        user,
+        lambda: sync_perun_groups(remote, user, sub=sub, claims=claims, force=force),
+    )
+
+
+def get_last_known_perun_groups(user):
+    # entitlements stored by the last successful sync of the user
+    return UserAAIGroup.get_users_groups([user.id])[user.id]
+
+
+def sync_perun_groups(remote, user, sub=None, claims=None, force=False):
+    inline = current_app.config["OAUTHCLIENT_CESNET_OPENID_SYNC_MODE"] != "task"
+    user_community_roles = None
+    fetch_perun_groups = partial(get_user_perun_groups, remote, sub=sub, claims=claims)
+    if (
+        inline
+        and current_app.config["OAUTHCLIENT_CESNET_OPENID_CONCURRENT_FETCH"]
+        and (
+            force
+            or not has_fingerprint(RemoteAccount.get(user.id, remote.consumer_key))
+        )
+    ):
+        # the sync runs whatever the groups are, call Perun while the
+        # memberships are read, the latency is the slower one; otherwise the
+        # memberships are read only if the fingerprint check fails
+        future = submit_in_context(
+            current_cesnet_openid.fetch_executor, fetch_perun_groups
+        )
+        user_community_roles = get_user_community_roles(user)
+        fetch_perun_groups = future.result
+
+    stale = False
+    try:
+        perun_groups = fetch_perun_groups()
+    except EntitlementsUnavailable as e:
+        current_app.logger.warning(
+            f"Using last known Perun groups of user {user.id}: {e}"
+        )
+        current_cesnet_openid.metrics_sink.increment("userinfo_fallbacks")
+        count("userinfo_fallbacks")
+        perun_groups = get_last_known_perun_groups(user)
+        stale = True
 
+    if not inline:
+        from cesnet_openid_remote.tasks import (
+            get_pending_fingerprint,
+            schedule_perun_groups_sync,
+        )
+
+        remote_account = RemoteAccount.get(user.id, remote.consumer_key)
+        fingerprint = sync_fingerprint(perun_groups)
+        # a pending task with other groups would overwrite the synced ones
+        pending_fingerprint = get_pending_fingerprint(user.id)
+        if (
+            force
+            or stale
+            or not is_synced(remote_account, fingerprint)
+            or pending_fingerprint not in (None, fingerprint)
+        ):
+            schedule_perun_groups_sync(
+                user, perun_groups, remote.consumer_key, force, stale=stale
+            )
+        return
 
-def link_perun_groups(remote, user):
-    user_community_roles = get_user_community_roles(user)
-    perun_groups = get_user_perun_groups(remote)
+    return sync_user_perun_groups(
+        user,
+        perun_groups,
+        remote.consumer_key,
+        force,
+        stale=stale,
+        user_community_roles=user_community_roles,
+    )
+
+
+def sync_user_perun_groups(
+    user,
+    perun_groups,
+    client_id=None,
+    force=False,
+    stale=False,
+    user_community_roles=None,
+):
+    remote_account = RemoteAccount.get(user.id, client_id) if client_id else None
+    fingerprint = sync_fingerprint(perun_groups)
+    if not force and not stale and is_synced(remote_account, fingerprint):
+        return
+
+    if user_community_roles is None:
+        user_community_roles = get_user_community_roles(user)
     communities = get_mapped_communities(perun_groups)
+    tag_profile(
+        user_id=user.id,
+        entitlements=len(perun_groups),
+        mapped_communities=len(communities),
+    )
+    plan = plan_user_sync(user_community_roles, perun_groups, communities)
+    if stale:
+        # the groups may be outdated, do not take anything away from the user
+        plan = additive_sync_plan(plan)
+        apply_sync_plan(user, plan)
+        return plan
+
+    if plan.conflicts:
+        abort(
+            403,
+            f"User cannot be in multiple roles: {next(iter(plan.conflicts.values()))}",
+        )
+    UserAAIGroup.set_user_groups(user.id, perun_groups)
+    apply_sync_plan(user, plan)
+
+    store_fingerprint(remote_account, fingerprint)
+    return plan
+
+
+def plan_user_sync(user_community_roles, perun_groups, communities) -> SyncPlan:
+    user_community_roles = dict(user_community_roles)
+    add, remove, conflicts = [], [], {}
 
-    # add part
     for community_id, mapping in communities.items():
         kept_roles, added_roles, removed_roles = split_user_roles(
             mapping, user_community_roles.pop(community_id, set()), perun_groups
         )
         if len(kept_roles) + len(added_roles) > 1:
-            abort(
-                403,
-                f"User cannot be in multiple roles: {kept_roles | added_roles}",
-            )
+            conflicts[community_id] = kept_roles | added_roles
+            continue
         if removed_roles:
-            remove_user_community_membership(community_id, user)
+            remove.append(community_id)
             added_roles.update(kept_roles)
         for role in added_roles:
-            add_user_community_membership(community_id, role, user)
+            add.append((community_id, role))
+
+    remove.extend(user_community_roles)
+    return SyncPlan(add=add, remove=remove, conflicts=conflicts)
+
+
+def additive_sync_plan(plan) -> SyncPlan:
+    removed = set(plan.remove)
+    return SyncPlan(
+        add=[(cid, role) for cid, role in plan.add if cid not in removed],
+        remove=[],
+        conflicts={},
+    )
+
+
+def apply_sync_plan(user, plan, uow=None):
+    if not plan.add and not plan.remove:
+        return
+
+    if uow is None:
+        # one transaction, one bulk index request and one refresh for all changes
+        with phase("membership_writes"), BulkIndexUnitOfWork() as uow:
+            apply_sync_plan(user, plan, uow=uow)
+            uow.commit()
+        count("db_commits")
+        return
 
-    for community_id in user_community_roles:
-        remove_user_community_membership(community_id, user)
+    for community_id in plan.remove:
+        remove_user_community_membership(community_id, user, uow=uow)
+    for community_id, role in plan.add:
+        add_user_community_membership(community_id, role, user, uow=uow)
+    count("memberships_removed", len(plan.remove))
+    count("memberships_added", len(plan.add))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Communities service components."""
+
+from invenio_records_resources.services.records.components import ServiceComponent
+from invenio_records_resources.services.uow import Operation, TaskOp
+from marshmallow import ValidationError
+
+from .mapping import invalidate_mapping_index
+from .models import AAIGroupMapping
+from .patterns import is_group_pattern, parse_group_pattern
+from .tasks import recompute_community_memberships
+
+
+def _aai_mapping(data):
+    return ((data or {}).get("custom_fields") or {}).get("aai_mapping") or []
+
+
+def _changed_groups(old_mapping, new_mapping):
+    old = {(e["aai_group"], e["role"]) for e in old_mapping}
+    new = {(e["aai_group"], e["role"]) for e in new_mapping}
+    return sorted({aai_group for aai_group, _ in old ^ new})
+
+
+def _validate_patterns(mapping):
+    for entry in mapping:
+        if is_group_pattern(entry["aai_group"]):
+            try:
+                parse_group_pattern(entry["aai_group"])
+            except ValueError as e:
+                raise ValidationError(str(e), field_name="custom_fields.aai_mapping")
+
+
+class InvalidateMappingOp(Operation):
+    """Invalidate the aai_mapping index once the change is committed."""
+
+    def on_post_commit(self, uow):
+        """Run the invalidation."""
+        invalidate_mapping_index()
+
+
+class AAIMappingComponent(ServiceComponent):
+    """Keeps the mapping table in sync with the communities' aai_mapping.
+
+    When a mapping changes, the memberships of the users holding the changed
+    groups are recomputed in a background task, without waiting for the users
+    to log in again.
+
+    Register it in ``COMMUNITIES_SERVICE_COMPONENTS`` after the default
+    community components.
+    """
+
+    def create(self, identity, data=None, record=None, uow=None, **kwargs):
+        """Store the mapping of the new community."""
+        mapping = _aai_mapping(record)
+        _validate_patterns(mapping)
+        if mapping:
+            AAIGroupMapping.set_community_mapping(record.id, mapping)
+            uow.register(InvalidateMappingOp())
+            self._recompute(record, [], mapping, uow)
+
+    def update(self, identity, data=None, record=None, uow=None, **kwargs):
+        """Store the community mapping if it was changed."""
+        # the record is already updated, the model holds the stored version
+        mapping = _aai_mapping(record)
+        old_mapping = _aai_mapping(record.model.json)
+        if mapping != old_mapping:
+            _validate_patterns(mapping)
+            AAIGroupMapping.set_community_mapping(record.id, mapping)
+            uow.register(InvalidateMappingOp())
+            self._recompute(record, old_mapping, mapping, uow)
+
+    def delete(self, identity, record=None, uow=None, **kwargs):
+        """Drop the mapping of the deleted community."""
+        if _aai_mapping(record):
+            AAIGroupMapping.delete_community_mapping(record.id)
+            uow.register(InvalidateMappingOp())
+
+    def _recompute(self, record, old_mapping, new_mapping, uow):
+        changed_groups = _changed_groups(old_mapping, new_mapping)
+        if changed_groups:
+            uow.register(
+                TaskOp(recompute_community_memberships, str(record.id), changed_groups)
+            )
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Default configuration for CESNET-OpenID-Remote."""
+
+OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX = False
+"""Resolve Perun groups through an in-process copy of the mapping table
+instead of querying the table on each login."""
+
+OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_MAX_AGE = 3600
+"""Seconds after which the in-process aai_mapping index is rebuilt even
+without an explicit invalidation (``None`` disables the periodic rebuild)."""
+
+OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_WARMUP_MAX_ENTRIES = 100000
+"""Largest mapping table indexed when a worker starts, larger ones are indexed
+on the first login (``None`` always indexes at start)."""
+
+OAUTHCLIENT_CESNET_OPENID_ISSUER = "https://login.cesnet.cz/oidc/"
+"""Expected issuer (``iss`` claim) of id_tokens."""
+
+OAUTHCLIENT_CESNET_OPENID_ID_TOKEN_ALGORITHMS = ["RS256"]
+"""Accepted id_token signature algorithms."""
+
+OAUTHCLIENT_CESNET_OPENID_ID_TOKEN_LEEWAY = 30
+"""Clock skew (in seconds) tolerated when validating id_token timestamps."""
+
+OAUTHCLIENT_CESNET_OPENID_JWKS_URL = "https://login.cesnet.cz/oidc/jwk"
+"""URL of the provider's JSON Web Key Set used to verify id_tokens."""
+
+OAUTHCLIENT_CESNET_OPENID_JWKS_TTL = 3600
+"""Seconds for which the downloaded key set is used before it is refreshed."""
+
+OAUTHCLIENT_CESNET_OPENID_JWKS_MIN_REFRESH_INTERVAL = 60
+"""Minimal number of seconds between key set downloads triggered by
+a token signed with an unknown key."""
+
+OAUTHCLIENT_CESNET_OPENID_JWKS_TIMEOUT = 10
+"""Read timeout (in seconds) of the key set download."""
+
+OAUTHCLIENT_CESNET_OPENID_HTTP_CONNECT_TIMEOUT = 3.05
+"""Connect timeout (in seconds) of the requests to the provider."""
+
+OAUTHCLIENT_CESNET_OPENID_HTTP_READ_TIMEOUT = 10
+"""Read timeout (in seconds) of the requests to the provider."""
+
+OAUTHCLIENT_CESNET_OPENID_HTTP_DEADLINE = 15
+"""Maximum time (in seconds) spent on a request to the provider, retries included."""
+
+OAUTHCLIENT_CESNET_OPENID_HTTP_RETRIES = 2
+"""Number of retries of idempotent requests failing with a connection error,
+timeout or 502/503/504 response."""
+
+OAUTHCLIENT_CESNET_OPENID_HTTP_BACKOFF = 0.2
+"""Base (in seconds) of the jittered exponential backoff between retries."""
+
+OAUTHCLIENT_CESNET_OPENID_HTTP_POOL_MAXSIZE = 10
+"""Number of keep-alive connections kept per host in each worker."""
+
+OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_CACHE = (
+    "cesnet_openid_remote.entitlements:LRUEntitlementCache"
+)
+"""Cache of users' Perun entitlements (``None`` disables caching). Use
+``cesnet_openid_remote.entitlements:SharedEntitlementCache`` to share the
+cache between workers."""
+
+OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_CACHE_TTL = 300
+"""Seconds for which cached entitlements are used instead of asking Perun."""
+
+OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_CACHE_MAXSIZE = 10000
+"""Maximal number of users in the in-process entitlement cache."""
+
+OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_THRESHOLD = 5
+"""Consecutive userinfo failures after which Perun is no longer called."""
+
+OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_RESET_TIMEOUT = 30
+"""Seconds after which the userinfo endpoint is tried again."""
+
+OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_SOURCE = "id_token_fallback"
+"""Where to take the user's ``eduperson_entitlement`` claim from: ``id_token``,
+``userinfo``, or ``id_token_fallback`` (id_token if it carries the claim,
+the userinfo endpoint otherwise). With ``id_token``, a missing claim keeps all
+the user's memberships, so it requires a provider always sending the claim,
+even if empty."""
+
+OAUTHCLIENT_CESNET_OPENID_SYNC_MODE = "inline"
+"""How Perun groups are synced on login: ``inline`` within the OAuth
+callback, or ``task`` in a Celery task so the login completes right away."""
+
+OAUTHCLIENT_CESNET_OPENID_CONCURRENT_FETCH = False
+"""Fetch the user's Perun groups while their memberships are read from the
+database (in ``inline`` sync mode), when the sync can not be skipped by the
+fingerprint check."""
+
+OAUTHCLIENT_CESNET_OPENID_FETCH_POOL_SIZE = 8
+"""Number of threads of each worker fetching Perun groups concurrently."""
+
+OAUTHCLIENT_CESNET_OPENID_SYNC_WAIT_TIMEOUT = 30
+"""Seconds a login waits for a concurrent sync of the same user in the worker
+before it syncs on its own."""
+
+OAUTHCLIENT_CESNET_OPENID_SYNC_ADVISORY_LOCK = False
+"""Serialize the syncs of a user across workers with a PostgreSQL advisory lock."""
+
+OAUTHCLIENT_CESNET_OPENID_SYNC_SNAPSHOT_TIMEOUT = 3600
+"""Seconds for which the latest scheduled sync of a user is remembered,
+older scheduled syncs of the user are skipped."""
+
+OAUTHCLIENT_CESNET_OPENID_METRICS = False
+"""Time the phases of each login and count its operations."""
+
+OAUTHCLIENT_CESNET_OPENID_METRICS_SINK = "cesnet_openid_remote.metrics:NoopMetricsSink"
+"""Where to publish the metrics, e.g.
+``cesnet_openid_remote.metrics:PrometheusMetricsSink`` (exported at
+``/cesnet-openid-remote/metrics`` if a metrics token is set)."""
+
+OAUTHCLIENT_CESNET_OPENID_METRICS_TOKEN = None
+"""Bearer token required to read ``/cesnet-openid-remote/metrics``, the endpoint
+is disabled if not set."""
+
+OAUTHCLIENT_CESNET_OPENID_PROFILE_SAMPLE_RATE = 0
+"""Fraction of logins profiled (0 disables profiling, 1 profiles all logins)."""
+
+OAUTHCLIENT_CESNET_OPENID_PROFILE_THRESHOLD = 2
+"""Seconds a profiled login must take for its profile to be kept."""
+
+OAUTHCLIENT_CESNET_OPENID_PROFILE_DIR = None
+"""Directory of the kept profiles, ``<instance path>/cesnet-openid-profiles``
+by default."""
+
+OAUTHCLIENT_CESNET_OPENID_PROFILE_MAX_BYTES = 100 * 1024 * 1024
+"""Size cap of the profile directory, the oldest profiles are deleted first."""
+
+OAUTHCLIENT_CESNET_OPENID_PROFILER = "cesnet_openid_remote.profiling:CProfileSampler"
+"""Profiler used for the sampled logins."""
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Caches of users' Perun entitlements keyed by the OIDC ``sub``."""
+
+import threading
+import time
+from collections import OrderedDict
+
+from invenio_cache import current_cache
+
+
+class LRUEntitlementCache:
+    """In-process LRU cache of entitlements with a time to live."""
+
+    def __init__(self, ttl, maxsize, clock=time.monotonic):
+        """Constructor."""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sub):
+        """Return the cached entitlements or ``None``."""
+        with self._lock:
+            entry = self._entries.get(sub)
+            if entry is None:
+                return None
+            expires_at, groups = entry
+            if expires_at <= self._clock():
+                del self._entries[sub]
+                return None
+            self._entries.move_to_end(sub)
+            return set(groups)
+
+    def set(self, sub, groups):
+        """Cache the entitlements of a user."""
+        with self._lock:
+            self._entries[sub] = (self._clock() + self.ttl, frozenset(groups))
+            self._entries.move_to_end(sub)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, sub):
+        """Forget the entitlements of a user."""
+        with self._lock:
+            self._entries.pop(sub, None)
+
+
+class SharedEntitlementCache:
+    """Entitlement cache stored in the Invenio cache, shared by all workers.
+
+    The size of the cache is bounded by the cache backend itself.
+    """
+
+    key_prefix = "cesnet_openid_remote:entitlements:"
+
+    def __init__(self, ttl, maxsize=None):
+        """Constructor."""
+        self.ttl = ttl
+
+    def get(self, sub):
+        """Return the cached entitlements or ``None``."""
+        groups = current_cache.get(self.key_prefix + sub)
+        return None if groups is None else set(groups)
+
+    def set(self, sub, groups):
+        """Cache the entitlements of a user."""
+        current_cache.set(self.key_prefix + sub, sorted(groups), timeout=self.ttl)
+
+    def delete(self, sub):
+        """Forget the entitlements of a user."""
+        current_cache.delete(self.key_prefix + sub)
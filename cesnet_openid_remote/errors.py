@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Errors of CESNET-OpenID-Remote."""
+
+
+class EntitlementsUnavailable(Exception):
+    """The user's entitlements could not be fetched from Perun."""
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""CESNET-OpenID-Remote Invenio extension."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from invenio_base.utils import obj_or_import_string
+from invenio_oauthclient.signals import account_info_received
+
+from . import config, handlers
+from .breaker import CircuitBreaker
+from .httpclient import PerunHTTPSession
+from .mapping import AAIMappingIndex, AAIPatternIndex, warm_mapping_index
+from .metrics import publish_login_timing
+from .profiling import save_login_profile
+from .sync import SyncCoordinator
+from .tokens import JWKSKeyCache
+
+
+class CESNETOpenIDRemote:
+    """CESNET-OpenID-Remote extension."""
+
+    def __init__(self, app=None):
+        """Extension initialization."""
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Flask application initialization."""
+        self.init_config(app)
+        self.mapping_index = AAIMappingIndex()
+        self.pattern_index = AAIPatternIndex()
+        self.sync_coordinator = SyncCoordinator()
+        self.jwks = JWKSKeyCache()
+        self.http = PerunHTTPSession()
+        self.userinfo_breaker = CircuitBreaker("userinfo")
+        self._fetch_executor = None
+        self._fetch_executor_lock = threading.Lock()
+        self._fetch_pool_size = app.config["OAUTHCLIENT_CESNET_OPENID_FETCH_POOL_SIZE"]
+        self.entitlement_cache = self.init_entitlement_cache(app)
+        self.metrics_sink = obj_or_import_string(
+            app.config["OAUTHCLIENT_CESNET_OPENID_METRICS_SINK"]
+        )()
+        app.teardown_request(publish_login_timing)
+        app.teardown_request(save_login_profile)
+        # create/update the user first, then sync their Perun groups
+        account_info_received.connect(handlers.autocreate_user)
+        account_info_received.connect(handlers.account_info_link_perun_groups)
+        app.extensions["cesnet-openid-remote"] = self
+
+    @property
+    def fetch_executor(self):
+        """Thread pool fetching login data concurrently, created on first use."""
+        if self._fetch_executor is None:
+            with self._fetch_executor_lock:
+                if self._fetch_executor is None:
+                    self._fetch_executor = ThreadPoolExecutor(
+                        max_workers=self._fetch_pool_size,
+                        thread_name_prefix="cesnet-openid-fetch",
+                    )
+        return self._fetch_executor
+
+    def init_config(self, app):
+        """Initialize configuration."""
+        for k in dir(config):
+            if k.startswith("OAUTHCLIENT_CESNET_OPENID_"):
+                app.config.setdefault(k, getattr(config, k))
+
+    def init_entitlement_cache(self, app):
+        """Create the configured entitlement cache."""
+        cache_cls = obj_or_import_string(
+            app.config["OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_CACHE"]
+        )
+        if cache_cls is None:
+            return None
+        return cache_cls(
+            ttl=app.config["OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_CACHE_TTL"],
+            maxsize=app.config["OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_CACHE_MAXSIZE"],
+        )
+
+
+def finalize_app(app):
+    """Warm the aai_mapping index when the application is created."""
+    if app.config["OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX"]:
+        warm_mapping_index()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Handlers of the CESNET remote app importing their implementation on first use."""
+
+
+def account_info(remote, resp):
+    """Retrieve remote account information, see :func:`.remote.account_info`."""
+    from .remote import account_info
+
+    return account_info(remote, resp)
+
+
+def account_info_serializer(remote, resp):
+    """Serialize the account info, see :func:`.remote.account_info_serializer`."""
+    from .remote import account_info_serializer
+
+    return account_info_serializer(remote, resp)
+
+
+def account_setup(remote, token, resp):
+    """Set up the account after login, see :func:`.remote.account_setup`."""
+    from .remote import account_setup
+
+    return account_setup(remote, token, resp)
+
+
+def autocreate_user(remote, **kwargs):
+    """Receiver of ``account_info_received``, see :func:`.remote.autocreate_user`."""
+    from .remote import autocreate_user
+
+    return autocreate_user(remote, **kwargs)
+
+
+def account_info_link_perun_groups(remote, **kwargs):
+    """Receiver of ``account_info_received`` syncing the user's Perun groups."""
+    from .communities import account_info_link_perun_groups
+
+    return account_info_link_perun_groups(remote, **kwargs)
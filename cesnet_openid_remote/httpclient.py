@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Pooled HTTP session used for the calls to the CESNET OIDC provider."""
+
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from flask import current_app
+from flask_oauthlib.client import OAuthRemoteApp, prepare_request
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .metrics import count
+
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+"""Only idempotent requests are retried, e.g. not the code for token exchange."""
+
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+def _counting_pool(pool_cls, stats, lock):
+    """Subclass of the urllib3 pool counting created and reused connections."""
+
+    class CountingConnectionPool(pool_cls):
+        def _new_conn(self):
+            with lock:
+                stats["connections_created"] += 1
+            return super()._new_conn()
+
+        def _get_conn(self, timeout=None):
+            with lock:
+                stats["connections_checked_out"] += 1
+            return super()._get_conn(timeout=timeout)
+
+    return CountingConnectionPool
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTP adapter whose connection pools update the given stats."""
+
+    def __init__(self, stats, lock, **kwargs):
+        """Constructor."""
+        self._stats = stats
+        self._stats_lock = lock
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager with counting connection pools."""
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._stats, self._stats_lock),
+            "https": _counting_pool(HTTPSConnectionPool, self._stats, self._stats_lock),
+        }
+
+
+class PerunHTTPSession:
+    """Keep-alive HTTP session shared by the threads of a worker.
+
+    Connections are pooled per host. Each request is bounded by
+    ``OAUTHCLIENT_CESNET_OPENID_HTTP_CONNECT_TIMEOUT`` and ``..._READ_TIMEOUT``
+    per attempt and by ``..._DEADLINE`` in total; idempotent requests failing
+    with a connection error, a timeout or a 502/503/504 are retried up to
+    ``..._RETRIES`` times with an exponential, fully jittered backoff.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        """The :class:`requests.Session`, created lazily in each process."""
+        # a session inherited from the parent process must not be shared
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._create_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = CountingHTTPAdapter(
+            self.stats,
+            self._lock,
+            pool_maxsize=current_app.config[
+                "OAUTHCLIENT_CESNET_OPENID_HTTP_POOL_MAXSIZE"
+            ],
+            max_retries=0,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        """Close all pooled connections."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def pool_stats(self):
+        """Return the counts of requests, retries and created/reused connections."""
+        with self._lock:
+            stats = dict(self.stats)
+        checked_out = stats.pop("connections_checked_out", 0)
+        stats.setdefault("connections_created", 0)
+        stats["connections_reused"] = max(checked_out - stats["connections_created"], 0)
+        return stats
+
+    def _backoff(self, attempt):
+        base = current_app.config["OAUTHCLIENT_CESNET_OPENID_HTTP_BACKOFF"]
+        return random.uniform(0, base * 2**attempt)
+
+    def _increment(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def request(self, method, url, read_timeout=None, **kwargs):
+        """Send a request, retrying idempotent ones within the deadline."""
+        config = current_app.config
+        method = method.upper()
+        connect_timeout = config["OAUTHCLIENT_CESNET_OPENID_HTTP_CONNECT_TIMEOUT"]
+        if read_timeout is None:
+            read_timeout = config["OAUTHCLIENT_CESNET_OPENID_HTTP_READ_TIMEOUT"]
+        retries = config["OAUTHCLIENT_CESNET_OPENID_HTTP_RETRIES"]
+        if method not in RETRY_METHODS:
+            retries = 0
+        deadline = time.monotonic() + config["OAUTHCLIENT_CESNET_OPENID_HTTP_DEADLINE"]
+
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            self._increment("requests")
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    timeout=(
+                        min(connect_timeout, remaining),
+                        min(read_timeout, remaining),
+                    ),
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if not self._retry(attempt, retries, deadline):
+                    self._increment("failures")
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or not self._retry(
+                    attempt, retries, deadline
+                ):
+                    return response
+                response.close()
+            attempt += 1
+
+    def _retry(self, attempt, retries, deadline):
+        """Sleep before the next attempt, return False if there is none."""
+        if attempt >= retries:
+            return False
+        backoff = self._backoff(attempt)
+        if time.monotonic() + backoff >= deadline:
+            return False
+        time.sleep(backoff)
+        self._increment("retries")
+        count("http_retries")
+        return True
+
+    def get(self, url, **kwargs):
+        """Send a GET request."""
+        return self.request("GET", url, **kwargs)
+
+
+class OAuthHTTPResponse:
+    """Response with the interface flask-oauthlib expects from urllib."""
+
+    def __init__(self, response):
+        """Constructor."""
+        self.code = response.status_code
+        self.headers = response.headers
+
+
+class PooledOAuthRemoteApp(OAuthRemoteApp):
+    """OAuth remote app sending its requests through the pooled session."""
+
+    def http_request(self, uri, headers=None, data=None, method=None):
+        """Send the request, see :meth:`OAuthRemoteApp.http_request`."""
+        from .proxies import current_cesnet_openid
+
+        uri, headers, data, method = prepare_request(uri, headers, data, method)
+        response = current_cesnet_openid.http.request(
+            method, uri, headers=headers, data=data
+        )
+        return OAuthHTTPResponse(response), response.content
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Lookup of community ``aai_mapping`` entries by Perun group."""
+
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from flask import current_app
+from invenio_access.permissions import system_identity
+from invenio_cache import current_cache
+from invenio_communities import current_communities
+from invenio_db import db
+from invenio_search.engine import dsl
+
+from .metrics import count
+from .models import AAIGroupMapping
+from .patterns import WILDCARD, GroupMatcher
+
+MAPPING_VERSION_CACHE_KEY = "cesnet_openid_remote:aai_mapping_version"
+
+
+def get_mapping_version():
+    """Return the version stamp of the communities' aai_mapping, shared by workers."""
+    return current_cache.get(MAPPING_VERSION_CACHE_KEY)
+
+
+def bump_mapping_version():
+    """Mark the aai_mapping of some community as changed for all workers."""
+    version = uuid.uuid4().hex
+    current_cache.set(MAPPING_VERSION_CACHE_KEY, version, timeout=0)
+    return version
+
+
+def load_community_mappings():
+    """Yield ``(community_id, aai_mapping)`` of all indexed communities with a mapping.
+
+    Used to (re)populate the mapping table, logins read the table instead.
+    Only the two fields are fetched from the index and no result items are
+    built, communities with large metadata are not loaded whole.
+    """
+    search = current_communities.service._search(
+        "scan",
+        system_identity,
+        {},
+        None,
+        extra_filter=dsl.Q("exists", field="custom_fields.aai_mapping"),
+    ).source(["id", "custom_fields.aai_mapping"])
+    for hit in search.scan():
+        community = hit.to_dict()
+        mapping = community.get("custom_fields", {}).get("aai_mapping")
+        if mapping:
+            yield community["id"], mapping
+
+
+def query_mapped_communities(perun_groups) -> Dict[str, List[dict]]:
+    """Return ``{community_id: [aai_mapping entries]}`` matching the groups.
+
+    Groups are looked up in the mapping table, patterns in the
+    :class:`AAIPatternIndex`.
+    """
+    from .proxies import current_cesnet_openid
+
+    if not perun_groups:
+        return {}
+
+    count("db_queries")
+    rows = db.session.query(
+        AAIGroupMapping.community_id, AAIGroupMapping.aai_group, AAIGroupMapping.role
+    ).filter(AAIGroupMapping.aai_group.in_(list(perun_groups)))
+
+    ret = defaultdict(list)
+    for community_id, aai_group, role in rows:
+        ret[str(community_id)].append({"aai_group": aai_group, "role": role})
+    for community_id, entries in current_cesnet_openid.pattern_index.lookup(
+        perun_groups
+    ).items():
+        ret[community_id].extend(entries)
+    return dict(ret)
+
+
+class AAIMappingIndex:
+    """In-process inverted index ``aai_group -> [(community_id, role)]``.
+
+    An optional cache in front of the mapping table, enabled by
+    ``OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX``. The index is built when the
+    worker starts (see :func:`warm_mapping_index`) and rebuilt when the shared
+    mapping version changes (see :func:`bump_mapping_version`) or when it gets
+    older than ``OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_MAX_AGE``. While one
+    login rebuilds the index, the other logins query the mapping table instead
+    of waiting for it. Patterns (see
+    :mod:`cesnet_openid_remote.patterns`) are compiled into a trie along with
+    the groups.
+    """
+
+    wait_for_rebuild = False
+    """Whether lookups wait for a rebuild running in another thread."""
+
+    def __init__(self):
+        """Constructor."""
+        self._matcher = GroupMatcher()
+        self._version = None
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drop the local index, it is rebuilt on the next lookup."""
+        self._built_at = None
+
+    def query_rows(self):
+        """Return the query of ``(aai_group, community_id, role)`` to index."""
+        return db.session.query(
+            AAIGroupMapping.aai_group,
+            AAIGroupMapping.community_id,
+            AAIGroupMapping.role,
+        )
+
+    def rebuild(self, version=None):
+        """Build the index from the mapping table."""
+        matcher = GroupMatcher()
+        for aai_group, community_id, role in self.query_rows():
+            try:
+                matcher.add(aai_group, (str(community_id), role))
+            except ValueError as e:
+                current_app.logger.warning(f"Community {community_id}: {e}")
+
+        self._matcher = matcher
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def is_stale(self, version):
+        """Return True if the index has to be rebuilt."""
+        if self._built_at is None or self._version != version:
+            return True
+        max_age = current_app.config["OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_MAX_AGE"]
+        return max_age is not None and time.monotonic() - self._built_at > max_age
+
+    def get_matcher(self, wait=True) -> Optional[GroupMatcher]:
+        """Return the compiled mapping, values are ``(community_id, role)``.
+
+        Returns ``None`` if the index is stale and being rebuilt by another
+        thread, unless ``wait`` is set.
+        """
+        version = get_mapping_version()
+        if self.is_stale(version):
+            if not self._lock.acquire(blocking=wait):
+                return None
+            try:
+                if self.is_stale(version):
+                    self.rebuild(version)
+            finally:
+                self._lock.release()
+        return self._matcher
+
+    def lookup(self, perun_groups) -> Dict[str, List[dict]]:
+        """Return ``{community_id: [aai_mapping entries]}`` matching the groups."""
+        matcher = self.get_matcher(wait=self.wait_for_rebuild)
+        if matcher is None:
+            return query_mapped_communities(perun_groups)
+        ret = defaultdict(list)
+        for aai_group, (community_id, role) in matcher.match(perun_groups):
+            ret[community_id].append({"aai_group": aai_group, "role": role})
+        return dict(ret)
+
+
+class AAIPatternIndex(AAIMappingIndex):
+    """In-process index of the mapping entries with a pattern only.
+
+    Patterns cannot be looked up in the mapping table by the user's groups, so
+    :func:`query_mapped_communities` matches them against this index. It is
+    compiled once per mapping version, like :class:`AAIMappingIndex`, and
+    lookups wait for the rebuild, there is nothing to fall back to.
+    """
+
+    wait_for_rebuild = True
+
+    def query_rows(self):
+        """Return the query of the patterns to index."""
+        return super().query_rows().filter(AAIGroupMapping.aai_group.endswith(WILDCARD))
+
+
+def warm_mapping_index():
+    """Build the aai_mapping index of this worker before the first login.
+
+    Skipped when the mapping table has more than
+    ``OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_WARMUP_MAX_ENTRIES`` entries, so
+    that a large table does not hold up the worker start; the index is then
+    built by the first login. Errors (e.g. the table does not exist yet when
+    the application is created by ``invenio db create``) are only logged.
+    """
+    from .proxies import current_cesnet_openid
+
+    max_entries = current_app.config[
+        "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_WARMUP_MAX_ENTRIES"
+    ]
+    try:
+        entries = db.session.query(AAIGroupMapping).count()
+        if max_entries is None or entries <= max_entries:
+            current_cesnet_openid.mapping_index.get_matcher()
+    except Exception:
+        current_app.logger.warning(
+            "The aai_mapping index could not be built.", exc_info=True
+        )
+        db.session.rollback()
+
+
+def invalidate_mapping_index():
+    """Invalidate the aai_mapping index in this and all other workers."""
+    from .proxies import current_cesnet_openid
+
+    bump_mapping_version()
+    current_cesnet_openid.mapping_index.invalidate()
+    current_cesnet_openid.pattern_index.invalidate()
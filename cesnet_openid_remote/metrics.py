@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Per-login timing and counters of the CESNET remote."""
+
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from flask import current_app, has_request_context, request
+
+from .signals import login_timed
+from .utils import is_copied_context, request_scope
+
+_no_phase = nullcontext()
+
+
+class LoginTiming:
+    """Time spent in the phases of one login and counters of its operations."""
+
+    def __init__(self):
+        """Constructor."""
+        self.started = time.perf_counter()
+        self.total = None
+        self.phases = defaultdict(float)
+        self.counters = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the block to the phase."""
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phases[name] += time.perf_counter() - started
+
+    def finish(self):
+        """Stop the total timer."""
+        self.total = time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Return the timing as a plain dict."""
+        return {
+            "total": self.total,
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+        }
+
+
+def current_timing():
+    """Return the timing of the login handled by this request.
+
+    Returns ``None`` when metrics are disabled or outside of a request.
+    """
+    if not has_request_context():
+        return None
+    if not current_app.config["OAUTHCLIENT_CESNET_OPENID_METRICS"]:
+        return None
+    scope = request_scope()
+    timing = scope.get("timing")
+    if timing is None:
+        timing = scope["timing"] = LoginTiming()
+    return timing
+
+
+def phase(name):
+    """Context manager timing a phase of the current login."""
+    timing = current_timing()
+    return _no_phase if timing is None else timing.phase(name)
+
+
+def timed(name):
+    """Decorator timing each call of the function as a phase of the login."""
+
+    def decorator(f):
+        @wraps(f)
+        def inner(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+def count(name, value=1):
+    """Increase a counter of the current login."""
+    timing = current_timing()
+    if timing is not None:
+        timing.counters[name] += value
+
+
+def publish_login_timing(exc=None):
+    """Publish the timing of the login, if any, at the end of the request."""
+    from .proxies import current_cesnet_openid
+
+    if is_copied_context():
+        # torn down when a concurrent fetch finishes, the login goes on
+        return
+    timing = request.environ.get("cesnet_openid_remote", {}).get("timing")
+    if timing is None:
+        return
+    timing.finish()
+    current_cesnet_openid.metrics_sink.record_login(timing)
+    login_timed.send(current_app._get_current_object(), timing=timing)
+
+
+class NoopMetricsSink:
+    """Metrics sink dropping everything."""
+
+    def record_login(self, timing):
+        """Record the timing of a login."""
+
+    def increment(self, name, value=1):
+        """Increase a counter."""
+
+    def set_gauge(self, name, value):
+        """Set a gauge."""
+
+
+_prometheus_collectors = {}
+_prometheus_collectors_lock = threading.Lock()
+
+
+def prometheus_collectors(registry):
+    """Return the collectors registered in the registry, created once.
+
+    Collectors can not be registered twice in a registry, while the UI and
+    API applications (each with its own sink) run in the same process.
+    """
+    import prometheus_client
+
+    with _prometheus_collectors_lock:
+        collectors = _prometheus_collectors.get(registry)
+        if collectors is None:
+            collectors = (
+                prometheus_client.Histogram(
+                    "cesnet_openid_login_phase_seconds",
+                    "Time spent in a phase of a login.",
+                    ["phase"],
+                    registry=registry,
+                ),
+                prometheus_client.Counter(
+                    "cesnet_openid_login_events",
+                    "Operations done during logins.",
+                    ["event"],
+                    registry=registry,
+                ),
+                prometheus_client.Counter(
+                    "cesnet_openid_events",
+                    "Events of the CESNET remote.",
+                    ["event"],
+                    registry=registry,
+                ),
+                prometheus_client.Gauge(
+                    "cesnet_openid_state",
+                    "State of the CESNET remote.",
+                    ["name"],
+                    registry=registry,
+                ),
+            )
+            _prometheus_collectors[registry] = collectors
+        return collectors
+
+
+class PrometheusMetricsSink(NoopMetricsSink):
+    """Metrics sink exporting to Prometheus, requires ``prometheus_client``."""
+
+    def __init__(self, registry=None):
+        """Constructor."""
+        import prometheus_client
+
+        self._prometheus = prometheus_client
+        self.registry = registry or prometheus_client.REGISTRY
+        (
+            self.phase_seconds,
+            self.login_events,
+            self.events,
+            self.gauges,
+        ) = prometheus_collectors(self.registry)
+
+    def record_login(self, timing):
+        """Record the timing of a login."""
+        self.phase_seconds.labels("total").observe(timing.total)
+        for name, seconds in timing.phases.items():
+            self.phase_seconds.labels(name).observe(seconds)
+        for name, value in timing.counters.items():
+            self.login_events.labels(name).inc(value)
+
+    def increment(self, name, value=1):
+        """Increase a counter."""
+        self.events.labels(name).inc(value)
+
+    def set_gauge(self, name, value):
+        """Set a gauge."""
+        self.gauges.labels(name).set(value)
+
+    def export(self):
+        """Return the metrics in the Prometheus text format."""
+        return self._prometheus.generate_latest(self.registry)
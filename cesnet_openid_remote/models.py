@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Database models for CESNET-OpenID-Remote."""
+
+from invenio_accounts.models import User
+from invenio_communities.communities.records.models import CommunityMetadata
+from invenio_db import db
+from sqlalchemy import or_
+from sqlalchemy_utils.types import UUIDType
+
+from .patterns import is_group_pattern, pattern_prefixes
+
+
+class AAIGroupMapping(db.Model):
+    """Normalized ``aai_mapping`` entry of a community.
+
+    Mirrors the ``custom_fields.aai_mapping`` of communities so that Perun
+    groups can be resolved to communities with a single indexed query.
+    """
+
+    __tablename__ = "cesnet_aai_group_mapping"
+
+    aai_group = db.Column(db.String(255), primary_key=True)
+    """Perun group (eduperson_entitlement) URN."""
+
+    community_id = db.Column(
+        UUIDType,
+        db.ForeignKey(CommunityMetadata.id, ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+    """Community the group is mapped to."""
+
+    role = db.Column(db.String(50), primary_key=True)
+    """Community role given to members of the group."""
+
+    @classmethod
+    def set_community_mapping(cls, community_id, mapping):
+        """Replace the stored mapping of a community."""
+        cls.delete_community_mapping(community_id)
+        entries = {(entry["aai_group"], entry["role"]) for entry in mapping or []}
+        db.session.add_all(
+            cls(aai_group=aai_group, community_id=community_id, role=role)
+            for aai_group, role in entries
+        )
+
+    @classmethod
+    def delete_community_mapping(cls, community_id):
+        """Delete the stored mapping of a community."""
+        cls.query.filter(cls.community_id == community_id).delete(
+            synchronize_session=False
+        )
+
+
+class UserAAIGroup(db.Model):
+    """Last known Perun group (entitlement) of a user.
+
+    Snapshot of the entitlements used by the last sync of the user, indexed
+    by group to find the users affected by a change of a community mapping.
+    """
+
+    __tablename__ = "cesnet_user_aai_group"
+
+    aai_group = db.Column(db.String(255), primary_key=True)
+    """Perun group (eduperson_entitlement) URN."""
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey(User.id, ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+    """User holding the group."""
+
+    @classmethod
+    def set_user_groups(cls, user_id, aai_groups):
+        """Replace the stored groups of a user, writing only the difference."""
+        stored = {
+            aai_group
+            for (aai_group,) in db.session.query(cls.aai_group).filter(
+                cls.user_id == user_id
+            )
+        }
+        aai_groups = set(aai_groups)
+        removed = stored - aai_groups
+        if removed:
+            cls.query.filter(cls.user_id == user_id, cls.aai_group.in_(removed)).delete(
+                synchronize_session=False
+            )
+        db.session.add_all(
+            cls(aai_group=aai_group, user_id=user_id)
+            for aai_group in aai_groups - stored
+        )
+
+    @classmethod
+    def get_users_groups(cls, user_ids):
+        """Return ``{user_id: {aai_group}}`` of the users."""
+        ret = {user_id: set() for user_id in user_ids}
+        rows = db.session.query(cls.user_id, cls.aai_group).filter(
+            cls.user_id.in_(user_ids)
+        )
+        for user_id, aai_group in rows:
+            ret[user_id].add(aai_group)
+        return ret
+
+    @classmethod
+    def query_user_ids(cls, aai_groups):
+        """Return a query of ids of users holding any of the groups.
+
+        Patterns (see :mod:`cesnet_openid_remote.patterns`) match the groups
+        of their subtree.
+        """
+        aai_groups = list(aai_groups)
+        groups = [g for g in aai_groups if not is_group_pattern(g)]
+        conditions = [cls.aai_group.in_(groups)]
+        for pattern in aai_groups:
+            if is_group_pattern(pattern):
+                for prefix in pattern_prefixes(pattern):
+                    if prefix.endswith((":", "#")):
+                        condition = cls.aai_group.startswith(prefix, autoescape=True)
+                    else:
+                        condition = cls.aai_group == prefix
+                    conditions.append(condition)
+        return (
+            db.session.query(cls.user_id)
+            .filter(or_(*conditions))
+            .distinct()
+            .order_by(cls.user_id)
+        )
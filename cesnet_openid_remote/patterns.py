@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Matching of Perun groups against ``aai_mapping`` entries with wildcards.
+
+Besides a group URN, an ``aai_group`` of a mapping entry can be a pattern
+targeting a subtree of Perun groups:
+
+* ``urn:geant:cesnet.cz:group:VO#*`` matches the group ``VO`` and all its
+  subgroups (e.g. ``urn:geant:cesnet.cz:group:VO:sub#perun.cesnet.cz``),
+* ``urn:geant:cesnet.cz:group:VO:*`` matches the subgroups of ``VO`` only.
+
+The authority (the part after ``#``) of the matched groups is not checked.
+"""
+
+from collections import defaultdict
+
+WILDCARD = "*"
+SUBTREE_SUFFIX = "#" + WILDCARD
+"""Suffix of a pattern matching the group and its subgroups."""
+
+DESCENDANTS_SUFFIX = ":" + WILDCARD
+"""Suffix of a pattern matching the subgroups of the group."""
+
+
+def is_group_pattern(aai_group):
+    """Return True if the ``aai_group`` is a pattern, not a single group."""
+    return aai_group.endswith(WILDCARD)
+
+
+def parse_group_urn(aai_group):
+    """Return the path of the group, e.g. ``("urn", "geant", ..., "VO", "sub")``."""
+    return tuple(aai_group.partition("#")[0].split(":"))
+
+
+def parse_group_pattern(pattern):
+    """Return ``(path, include_self)`` of the pattern.
+
+    Raises :class:`ValueError` if the pattern is not supported.
+    """
+    if pattern.endswith(SUBTREE_SUFFIX):
+        include_self = True
+    elif pattern.endswith(DESCENDANTS_SUFFIX):
+        include_self = False
+    else:
+        raise ValueError(
+            f"Unsupported group pattern {pattern!r}, "
+            f"it must end with {SUBTREE_SUFFIX!r} or {DESCENDANTS_SUFFIX!r}."
+        )
+    path = pattern[: -len(SUBTREE_SUFFIX)]
+    if not path or WILDCARD in path or "#" in path:
+        raise ValueError(f"Unsupported group pattern {pattern!r}.")
+    return tuple(path.split(":")), include_self
+
+
+def pattern_prefixes(pattern):
+    """Return the group URN prefixes matched by the pattern.
+
+    A group is matched if it equals one of the prefixes ending with a path
+    segment or starts with one of the prefixes ending with a separator.
+    """
+    path, include_self = parse_group_pattern(pattern)
+    path = ":".join(path)
+    if include_self:
+        return [path, path + "#", path + ":"]
+    return [path + ":"]
+
+
+def pattern_matches(pattern, aai_group):
+    """Return True if the pattern matches the group."""
+    path, include_self = parse_group_pattern(pattern)
+    group_path = parse_group_urn(aai_group)
+    return group_path[: len(path)] == path and (
+        include_self or len(group_path) > len(path)
+    )
+
+
+class _Node:
+    __slots__ = ("children", "subtree", "descendants")
+
+    def __init__(self):
+        self.children = {}
+        self.subtree = []
+        self.descendants = []
+
+
+class GroupMatcher:
+    """Mapping entries compiled for matching against a user's groups.
+
+    Groups are looked up in a dict, patterns in a trie over the segments of
+    the group path. Matching costs ``O(groups x path length)``, regardless of
+    the number of mapping entries.
+    """
+
+    def __init__(self, entries=()):
+        """Constructor, ``entries`` are ``(aai_group, value)`` pairs."""
+        self.groups = defaultdict(list)
+        self.patterns = 0
+        self._root = _Node()
+        for aai_group, value in entries:
+            self.add(aai_group, value)
+
+    def add(self, aai_group, value):
+        """Add the group or pattern with the value returned when matched."""
+        if not is_group_pattern(aai_group):
+            self.groups[aai_group].append(value)
+            return
+        path, include_self = parse_group_pattern(aai_group)
+        node = self._root
+        for segment in path:
+            node = node.children.setdefault(segment, _Node())
+        (node.subtree if include_self else node.descendants).append(value)
+        self.patterns += 1
+
+    def match_group(self, aai_group):
+        """Return the values of the entries matching the group."""
+        ret = list(self.groups.get(aai_group, ()))
+        if not self.patterns:
+            return ret
+        path = parse_group_urn(aai_group)
+        node = self._root
+        for depth, segment in enumerate(path, start=1):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            ret.extend(node.subtree)
+            if depth < len(path):
+                ret.extend(node.descendants)
+        return ret
+
+    def match(self, perun_groups):
+        """Yield ``(aai_group, value)`` of the entries matching the groups."""
+        for aai_group in perun_groups:
+            for value in self.match_group(aai_group):
+                yield aai_group, value
+
+
+def match_mapping(mapping, perun_groups):
+    """Return the ``aai_mapping`` entries matching the groups.
+
+    The ``aai_group`` of a matched pattern is replaced by the matching group,
+    so the entries can be passed to
+    :func:`cesnet_openid_remote.communities.split_user_roles`.
+    """
+    matcher = GroupMatcher((entry["aai_group"], entry["role"]) for entry in mapping)
+    return [
+        {"aai_group": aai_group, "role": role}
+        for aai_group, role in matcher.match(perun_groups)
+    ]
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Sampled profiling of slow logins."""
+
+import cProfile
+import hashlib
+import hmac
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, has_request_context, request
+from invenio_base.utils import obj_or_import_string
+
+from .utils import is_copied_context, request_scope
+
+_profiling = threading.Lock()
+"""Held while a login is profiled, profilers can not run concurrently (since
+Python 3.12, ``sys.monitoring`` used by cProfile is process-wide)."""
+
+
+class CProfileSampler:
+    """Profiler of a login, collecting cProfile statistics."""
+
+    def __init__(self):
+        """Constructor."""
+        self._profile = cProfile.Profile()
+
+    def enable(self):
+        """Start (or resume) profiling."""
+        self._profile.enable()
+
+    def disable(self):
+        """Pause profiling."""
+        self._profile.disable()
+
+    def dump(self, path):
+        """Write the collected statistics to the file."""
+        self._profile.dump_stats(path)
+
+
+class LoginProfile:
+    """Profile of the profiled parts of one login."""
+
+    def __init__(self, sampler):
+        """Constructor."""
+        self.sampler = sampler
+        self.elapsed = 0.0
+        self.tags = {}
+        self.failed = False
+        self._depth = 0
+        self._started = None
+        self._enabled = False
+
+    @contextmanager
+    def profile(self):
+        """Profile the block, nested blocks are profiled once.
+
+        If the profiler can not be started, the block runs unprofiled and the
+        profile is not kept.
+        """
+        if self._depth == 0:
+            self._started = time.perf_counter()
+            try:
+                self.sampler.enable()
+                self._enabled = True
+            except Exception as e:
+                current_app.logger.warning(f"Login not profiled: {e}")
+                self.failed = True
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                if self._enabled:
+                    self.sampler.disable()
+                    self._enabled = False
+                self.elapsed += time.perf_counter() - self._started
+
+
+def current_profile():
+    """Return the profile of the login handled by this request, if sampled.
+
+    A single login is profiled at a time, logins sampled meanwhile are not
+    profiled.
+    """
+    if not has_request_context():
+        return None
+    sample_rate = current_app.config["OAUTHCLIENT_CESNET_OPENID_PROFILE_SAMPLE_RATE"]
+    if not sample_rate:
+        return None
+    scope = request_scope()
+    if "profile" not in scope:
+        scope["profile"] = None
+        # released by save_login_profile when the request ends
+        if random.random() < sample_rate and _profiling.acquire(blocking=False):
+            try:
+                sampler_cls = obj_or_import_string(
+                    current_app.config["OAUTHCLIENT_CESNET_OPENID_PROFILER"]
+                )
+                scope["profile"] = LoginProfile(sampler_cls())
+            except BaseException:
+                _profiling.release()
+                raise
+    return scope["profile"]
+
+
+def profiled(f):
+    """Decorator profiling the function in sampled logins."""
+
+    @wraps(f)
+    def inner(*args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return f(*args, **kwargs)
+        with profile.profile():
+            return f(*args, **kwargs)
+
+    return inner
+
+
+def tag_profile(**tags):
+    """Attach tags (user id, entitlement and community counts) to the profile."""
+    profile = current_profile()
+    if profile is not None:
+        profile.tags.update(tags)
+
+
+def anonymize_user_id(user_id):
+    """Return a stable pseudonym of the user id."""
+    key = current_app.config["SECRET_KEY"] or ""
+    return hmac.new(
+        key.encode("utf-8"), str(user_id).encode("utf-8"), hashlib.sha256
+    ).hexdigest()[:12]
+
+
+def profile_dir():
+    """Return the directory slow login profiles are stored in."""
+    return current_app.config["OAUTHCLIENT_CESNET_OPENID_PROFILE_DIR"] or os.path.join(
+        current_app.instance_path, "cesnet-openid-profiles"
+    )
+
+
+def profile_filename(profile):
+    """Return the file name of the profile, carrying its tags."""
+    tags = profile.tags
+    user = anonymize_user_id(tags["user_id"]) if "user_id" in tags else "anonymous"
+    return "login-{}-u{}-e{}-c{}-{}ms.prof".format(
+        datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f"),
+        user,
+        tags.get("entitlements", "x"),
+        tags.get("mapped_communities", "x"),
+        int(profile.elapsed * 1000),
+    )
+
+
+def rotate_profiles(directory, max_bytes):
+    """Delete the oldest profiles until the directory is within the size cap."""
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(".prof"):
+            stat = entry.stat()
+            profiles.append((stat.st_mtime, stat.st_size, entry.path))
+    profiles.sort()
+    total = sum(size for _, size, _ in profiles)
+    for _, size, path in profiles:
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def save_login_profile(exc=None):
+    """Keep the profile of the login, if any, when the login was slow."""
+    if is_copied_context():
+        return
+    profile = request.environ.get("cesnet_openid_remote", {}).get("profile")
+    if profile is None:
+        return
+    try:
+        _save_login_profile(profile)
+    finally:
+        _profiling.release()
+
+
+def _save_login_profile(profile):
+    config = current_app.config
+    if (
+        profile.failed
+        or profile.elapsed < config["OAUTHCLIENT_CESNET_OPENID_PROFILE_THRESHOLD"]
+    ):
+        return
+
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, profile_filename(profile))
+    profile.sampler.dump(path)
+    rotate_profiles(directory, config["OAUTHCLIENT_CESNET_OPENID_PROFILE_MAX_BYTES"])
+    current_app.logger.info(
+        f"Login took {profile.elapsed:.3f}s, profile saved to {path}"
+    )
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Proxies for CESNET-OpenID-Remote."""
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+current_cesnet_openid = LocalProxy(
+    lambda: current_app.extensions["cesnet-openid-remote"]
+)
+"""Proxy to the instantiated CESNET-OpenID-Remote extension."""
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Bulk reconciliation of community memberships with a Perun export."""
+
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from flask import current_app
+from invenio_accounts.models import User, UserIdentity
+from invenio_communities.members.records.models import MemberModel
+from invenio_db import db
+from sqlalchemy.orm import joinedload
+
+from .communities import apply_sync_plan, plan_user_sync
+from .models import AAIGroupMapping, UserAAIGroup
+from .patterns import match_mapping
+from .proxies import current_cesnet_openid
+from .uow import BulkIndexUnitOfWork
+
+
+def read_export(stream, export_format="jsonl"):
+    """Yield ``(sub, eduperson_entitlement)`` pairs from an export.
+
+    ``jsonl`` exports have one ``{"sub": ..., "eduperson_entitlement": [...]}``
+    object per line, ``csv`` exports have ``sub`` and ``eduperson_entitlement``
+    columns with entitlements separated by ``;``.
+    """
+    if export_format == "csv":
+        for row in csv.DictReader(stream):
+            entitlements = row.get("eduperson_entitlement") or ""
+            yield row["sub"], [e for e in entitlements.split(";") if e]
+        return
+
+    for line in stream:
+        if line.strip():
+            entry = json.loads(line)
+            yield entry["sub"], entry.get("eduperson_entitlement") or []
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def get_users_community_roles(user_ids):
+    """Return ``{user_id: {community_id: {roles}}}`` read with one query."""
+    ret = defaultdict(lambda: defaultdict(set))
+    memberships = db.session.query(
+        MemberModel.user_id, MemberModel.community_id, MemberModel.role
+    ).filter(MemberModel.user_id.in_(user_ids), MemberModel.active.is_(True))
+    for user_id, community_id, role in memberships:
+        ret[user_id][str(community_id)].add(role)
+    return ret
+
+
+def plan_users_sync(identities, entitlements):
+    """Yield ``(identity, plan)`` for the identities.
+
+    Current memberships of all the users are read with one query.
+    """
+    mapping_index = current_cesnet_openid.mapping_index
+    current_roles = get_users_community_roles([i.id_user for i in identities])
+    for identity in identities:
+        perun_groups = set(entitlements[identity.id])
+        plan = plan_user_sync(
+            current_roles.get(identity.id_user, {}),
+            perun_groups,
+            mapping_index.lookup(perun_groups),
+        )
+        yield identity, plan
+
+
+def get_planner(engine):
+    """Return the function planning the syncs of a chunk.
+
+    ``python`` plans user by user, ``batch`` plans the whole chunk at once with
+    sparse matrices (requires the ``batch`` extra).
+    """
+    if engine == "batch":
+        from .batch import plan_users_sync_batch
+
+        return plan_users_sync_batch
+    return plan_users_sync
+
+
+def reconcile_chunk(entries, method="perun", engine="python"):
+    """Sync the memberships of a chunk of ``(sub, entitlements)`` pairs.
+
+    All changes of the chunk are applied in one unit of work. Returns a
+    :class:`collections.Counter` with ``users``, ``unknown``, ``added``,
+    ``removed`` and ``failures``.
+    """
+    stats = Counter()
+    entitlements = dict(entries)
+    identities = (
+        UserIdentity.query.options(joinedload(UserIdentity.user))
+        .filter(
+            UserIdentity.method == method,
+            UserIdentity.id.in_(list(entitlements)),
+        )
+        .all()
+    )
+    stats["users"] = len(entitlements)
+    stats["unknown"] = len(entitlements) - len(identities)
+
+    plans = []
+    for identity, plan in get_planner(engine)(identities, entitlements):
+        if plan.conflicts:
+            current_app.logger.warning(
+                f"User {identity.id_user} not synced, multiple roles: {plan.conflicts}"
+            )
+            stats["failures"] += 1
+            continue
+        UserAAIGroup.set_user_groups(identity.id_user, entitlements[identity.id])
+        if plan.add or plan.remove:
+            plans.append((identity.user, plan))
+
+    try:
+        with BulkIndexUnitOfWork() as uow:
+            for user, plan in plans:
+                apply_sync_plan(user, plan, uow=uow)
+            uow.commit()
+    except Exception:
+        current_app.logger.exception("Bulk sync failed, syncing users one by one.")
+        db.session.rollback()
+        plans = _reconcile_one_by_one(identities, entitlements, stats)
+
+    for _, plan in plans:
+        stats["added"] += len(plan.add)
+        stats["removed"] += len(plan.remove)
+    return stats
+
+
+def _reconcile_one_by_one(identities, entitlements, stats):
+    applied = []
+    for identity in identities:
+        # plan again, part of the changes may have been applied already
+        _, plan = next(plan_users_sync([identity], entitlements))
+        if plan.conflicts:
+            continue
+        try:
+            UserAAIGroup.set_user_groups(identity.id_user, entitlements[identity.id])
+            apply_sync_plan(identity.user, plan)
+            db.session.commit()
+        except Exception:
+            current_app.logger.exception(f"User {identity.id_user} not synced.")
+            db.session.rollback()
+            stats["failures"] += 1
+        else:
+            if plan.add or plan.remove:
+                applied.append((identity.user, plan))
+    return applied
+
+
+def recompute_community(community_id, aai_groups, chunk_size=500):
+    """Sync the memberships of a community after its mapping changed.
+
+    Only users whose last known entitlements contain one of the changed
+    ``aai_groups`` are touched. Returns a :class:`collections.Counter` with
+    ``users``, ``added``, ``removed`` and ``failures``.
+    """
+    stats = Counter()
+    mapping = [
+        {"aai_group": aai_group, "role": role}
+        for aai_group, role in db.session.query(
+            AAIGroupMapping.aai_group, AAIGroupMapping.role
+        ).filter(AAIGroupMapping.community_id == community_id)
+    ]
+    user_ids = [user_id for (user_id,) in UserAAIGroup.query_user_ids(aai_groups)]
+
+    for chunk in chunked(user_ids, chunk_size):
+        users_groups = UserAAIGroup.get_users_groups(chunk)
+        current_roles = defaultdict(set)
+        memberships = db.session.query(MemberModel.user_id, MemberModel.role).filter(
+            MemberModel.community_id == community_id,
+            MemberModel.user_id.in_(chunk),
+            MemberModel.active.is_(True),
+        )
+        for user_id, role in memberships:
+            current_roles[user_id].add(role)
+
+        plans = []
+        for user in User.query.filter(User.id.in_(chunk)):
+            perun_groups = users_groups[user.id]
+            matched = match_mapping(mapping, perun_groups)
+            plan = plan_user_sync(
+                (
+                    {community_id: current_roles[user.id]}
+                    if user.id in current_roles
+                    else {}
+                ),
+                perun_groups,
+                {community_id: matched} if matched else {},
+            )
+            if plan.conflicts:
+                stats["failures"] += 1
+            elif plan.add or plan.remove:
+                plans.append((user, plan))
+
+        with BulkIndexUnitOfWork() as uow:
+            for user, plan in plans:
+                apply_sync_plan(user, plan, uow=uow)
+            uow.commit()
+
+        stats["users"] += len(chunk)
+        for _, plan in plans:
+            stats["added"] += len(plan.add)
+            stats["removed"] += len(plan.remove)
+    return stats
+
+
+_worker_app = None
+
+
+def init_worker():
+    """Create the application in a reconciliation worker process."""
+    from invenio_app.factory import create_api
+
+    global _worker_app
+    _worker_app = create_api()
+    _worker_app.app_context().push()
+
+
+def reconcile_chunk_in_worker(entries, method, engine):
+    """Run :func:`reconcile_chunk` in a worker process."""
+    try:
+        return reconcile_chunk(entries, method, engine)
+    finally:
+        db.session.remove()
+
+
+class Checkpoint:
+    """Number of export entries already reconciled, stored in a file."""
+
+    def __init__(self, path):
+        """Constructor."""
+        self.path = path
+        self.offset = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.offset = json.load(f)["offset"]
+
+    def save(self, offset):
+        """Store the offset."""
+        self.offset = offset
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"offset": offset}, f)
+        os.replace(tmp_path, self.path)
+
+
+def reconcile_export(
+    entries,
+    method="perun",
+    chunk_size=500,
+    processes=1,
+    checkpoint=None,
+    engine="python",
+):
+    """Reconcile the memberships of all users in an export.
+
+    The entries are processed in chunks, by a pool of ``processes`` worker
+    processes if more than one. At most two chunks per process are kept in
+    memory. After each finished chunk the checkpoint is advanced past all
+    entries reconciled so far, a later run with the same checkpoint skips
+    them. Returns the summed statistics of :func:`reconcile_chunk` and the
+    ``elapsed`` time in seconds.
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    chunks = enumerate(chunked(islice(entries, checkpoint.offset, None), chunk_size))
+    stats = Counter()
+    started = time.monotonic()
+
+    finished = {}
+    next_chunk = 0
+    offset = checkpoint.offset
+
+    def chunk_done(index, size, chunk_stats):
+        nonlocal next_chunk, offset
+        stats.update(chunk_stats)
+        finished[index] = size
+        while next_chunk in finished:
+            offset += finished.pop(next_chunk)
+            next_chunk += 1
+        checkpoint.save(offset)
+
+    if processes <= 1:
+        for index, chunk in chunks:
+            chunk_done(index, len(chunk), reconcile_chunk(chunk, method, engine))
+    else:
+        with ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        ) as pool:
+            pending = {}
+
+            def collect(futures):
+                for future in futures:
+                    index, size = pending.pop(future)
+                    try:
+                        chunk_stats = future.result()
+                    except Exception:
+                        current_app.logger.exception(f"Chunk {index} failed.")
+                        chunk_stats = Counter(users=size, failures=size)
+                    chunk_done(index, size, chunk_stats)
+
+            for index, chunk in chunks:
+                future = pool.submit(reconcile_chunk_in_worker, chunk, method, engine)
+                pending[future] = (index, len(chunk))
+                if len(pending) >= 2 * processes:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            collect(wait(pending).done)
+
+    stats["elapsed"] = time.monotonic() - started
+    return stats
@@ -6,18 +6,28 @@
 # modify it under the terms of the MIT License; see LICENSE file for more
 # details.
 
+import copy
 import datetime
 
-import jwt
 from invenio_accounts.models import User, UserIdentity
 from invenio_db import db
 from invenio_oauthclient import current_oauthclient
 from invenio_oauthclient.contrib.settings import OAuthSettingsHelper
-from invenio_oauthclient.signals import account_info_received
 from invenio_oauthclient.utils import oauth_link_external_id
+from sqlalchemy.orm import joinedload
 
-from cesnet_openid_remote.communities import account_info_link_perun_groups, \
-    link_perun_groups
+from cesnet_openid_remote.communities import link_perun_groups
+from cesnet_openid_remote.metrics import count, timed
+from cesnet_openid_remote.profiling import profiled
+
+# REMOTE_APP is re-exported for configurations importing it from this module,
+# cesnet_openid_remote.remote_app is much cheaper to import
+from cesnet_openid_remote.remote_app import (  # noqa: F401
+    HANDLERS,
+    REMOTE_APP,
+    REST_HANDLERS,
+)
+from cesnet_openid_remote.tokens import decode_id_token
 
 
 class CesnetOAuthSettingsHelper(OAuthSettingsHelper):
@@ -42,29 +52,9 @@ class CesnetOAuthSettingsHelper(OAuthSettingsHelper):
             signup_options=None,
         )
 
-        self._handlers = dict(
-            authorized_handler="invenio_oauthclient.handlers:authorized_signup_handler",
-            signup_handler=dict(
-                info="cesnet_openid_remote.remote:account_info",
-                info_serializer="cesnet_openid_remote.remote:account_info_serializer",
-                setup="cesnet_openid_remote.remote:account_setup",
-                view="invenio_oauthclient.handlers:signup_handler",
-            ),
-        )
-
-        self._rest_handlers = dict(
-            authorized_handler="invenio_oauthclient.handlers.rest:authorized_signup_handler",
-            signup_handler=dict(
-                info="cesnet_openid_remote.remote:account_info",
-                info_serializer="cesnet_openid_remote.remote:account_info_serializer",
-                setup="cesnet_openid_remote.remote:account_setup",
-                view="invenio_oauthclient.handlers.rest:signup_handler",
-            ),
-            response_handler="invenio_oauthclient.handlers.rest:default_remote_response_handler",
-            authorized_redirect_url="/",
-            signup_redirect_url="/",
-            error_redirect_url="/",
-        )
+        self.base_app["remote_app"] = REMOTE_APP["remote_app"]
+        self._handlers = copy.deepcopy(HANDLERS)
+        self._rest_handlers = copy.deepcopy(REST_HANDLERS)
 
     def get_handlers(self):
         """Return CESNET auth handlers."""
@@ -75,14 +65,7 @@ class CesnetOAuthSettingsHelper(OAuthSettingsHelper):
         return self._rest_handlers
 
 
-_cesnet_app = CesnetOAuthSettingsHelper()
-
-"""
-CESNET OpenID remote app.
-"""
-REMOTE_APP = _cesnet_app.remote_app
-
-
+@timed("account_info_serializer")
 def account_info_serializer(remote, resp):
     """
     Serialize the account info response object.
@@ -92,7 +75,7 @@ def account_info_serializer(remote, resp):
 
     :returns: A dictionary with serialized user information.
     """
-    decoded_token = jwt.decode(resp["id_token"], options={"verify_signature": True})
+    decoded_token = decode_id_token(remote, resp)
 
     return {
         "external_id": decoded_token["sub"],
@@ -132,6 +115,8 @@ def account_info(remote, resp):
     return handler_resp
 
 
+@profiled
+@timed("account_setup")
 def account_setup(remote, token, resp):
     """
     Perform additional setup after user have been logged in.
@@ -140,10 +125,11 @@ def account_setup(remote, token, resp):
     :param token: The token value.
     :param resp: The response.
     """
-    decoded_token = jwt.decode(resp["id_token"], options={"verify_signature": True})
+    decoded_token = decode_id_token(remote, resp)
 
     with db.session.begin_nested():
         token.remote_account.extra_data = {
+            **(token.remote_account.extra_data or {}),
             "full_name": decoded_token["name"],
         }
 
@@ -152,11 +138,11 @@ def account_setup(remote, token, resp):
         # Create user <-> external id link.
         oauth_link_external_id(user, {"id": decoded_token["sub"], "method": "perun"})
 
-    link_perun_groups(remote, user)
+    link_perun_groups(remote, user, sub=decoded_token["sub"], claims=decoded_token)
 
 
-# During overlay initialization.
-@account_info_received.connect
+@profiled
+@timed("autocreate_user")
 def autocreate_user(remote, token=None, response=None, account_info=None):
     assert account_info is not None
 
@@ -167,7 +153,11 @@ def autocreate_user(remote, token=None, response=None, account_info=None):
         "full_name": account_info["user"]["profile"]["full_name"],
     }
 
-    user_identity = UserIdentity.query.filter_by(id=id, method=method).one_or_none()
+    user_identity = (
+        UserIdentity.query.options(joinedload(UserIdentity.user))
+        .filter_by(id=id, method=method)
+        .one_or_none()
+    )
     if not user_identity:
         user = User(email=email, active=True, user_profile=user_profile)
 
@@ -181,36 +171,28 @@ def autocreate_user(remote, token=None, response=None, account_info=None):
         """
         user.confirmed_at = datetime.datetime.now()
 
-        try:
-            db.session.add(user)
-        except:
-            db.session.rollback()
-            raise
-        finally:
-            db.session.commit()
-
-        user_identity = UserIdentity(id=id, method=method, id_user=user.id)
-        try:
-            db.session.add(user_identity)
-        except:
-            db.session.rollback()
-            raise
-        finally:
-            db.session.commit()
+        db.session.add(user)
+        db.session.add(UserIdentity(id=id, method=method, user=user))
 
     else:
-        assert user_identity.user is not None
-
-        user_identity.user.email = email
-        user_identity.user.user_profile = user_profile
-
-        try:
-            db.session.add(user_identity.user)
-        except:
-            db.session.rollback()
-            raise
-        finally:
-            db.session.commit()
-
-
-account_info_received.connect(account_info_link_perun_groups)
+        user = user_identity.user
+        assert user is not None
+
+        changed = False
+        # emails are stored lowercased
+        if email is not None and user.email != email.lower():
+            user.email = email
+            changed = True
+        if dict(user.user_profile or {}) != user_profile:
+            user.user_profile = user_profile
+            changed = True
+        if not changed:
+            return
+
+    # create/update the user and its identity in a single transaction
+    try:
+        db.session.commit()
+        count("db_commits")
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Configuration of the CESNET remote app.
+
+Meant to be imported from ``invenio.cfg``, so it must not import anything
+heavy: the handlers are referenced by import strings and import the modules
+doing the work on first use.
+"""
+
+import copy
+
+BASE_URL = "https://login.cesnet.cz/oidc/"
+
+HANDLERS = dict(
+    authorized_handler="invenio_oauthclient.handlers:authorized_signup_handler",
+    signup_handler=dict(
+        info="cesnet_openid_remote.handlers:account_info",
+        info_serializer="cesnet_openid_remote.handlers:account_info_serializer",
+        setup="cesnet_openid_remote.handlers:account_setup",
+        view="invenio_oauthclient.handlers:signup_handler",
+    ),
+)
+
+REST_HANDLERS = dict(
+    authorized_handler="invenio_oauthclient.handlers.rest:authorized_signup_handler",
+    signup_handler=dict(
+        info="cesnet_openid_remote.handlers:account_info",
+        info_serializer="cesnet_openid_remote.handlers:account_info_serializer",
+        setup="cesnet_openid_remote.handlers:account_setup",
+        view="invenio_oauthclient.handlers.rest:signup_handler",
+    ),
+    response_handler="invenio_oauthclient.handlers.rest:default_remote_response_handler",
+    authorized_redirect_url="/",
+    signup_redirect_url="/",
+    error_redirect_url="/",
+)
+
+
+def cesnet_remote_app(base_url=BASE_URL, rest=False):
+    """Return the configuration of the CESNET remote app.
+
+    Same as ``OAuthSettingsHelper`` would create, ``base_url`` allows to
+    point the app at another provider (e.g. a stub one in tests).
+    """
+    base_url = "{}/".format(base_url.rstrip("/"))
+    remote_app = dict(
+        title="Perun",
+        description="Perun oauth service.",
+        icon="",
+        precedence_mask={
+            "email": True,
+            "password": False,
+            "profile": {
+                "username": False,
+                "full_name": False,
+            },
+        },
+        signup_options={"auto_confirm": True, "send_register_msg": False},
+        logout_url=None,
+        params=dict(
+            base_url=base_url,
+            request_token_params={
+                "scope": "openid profile email eduperson_entitlement isCesnetEligibleLastSeen"
+            },
+            request_token_url=None,
+            access_token_url=f"{base_url}token",
+            access_token_method="POST",
+            authorize_url=f"{base_url}authorize",
+            app_key="PERUN_APP_CREDENTIALS",
+            content_type="application/json",
+        ),
+        remote_app="cesnet_openid_remote.httpclient:PooledOAuthRemoteApp",
+    )
+    remote_app.update(copy.deepcopy(REST_HANDLERS if rest else HANDLERS))
+    return remote_app
+
+
+REMOTE_APP = cesnet_remote_app()
+"""CESNET OpenID remote app."""
+
+REMOTE_REST_APP = cesnet_remote_app(rest=True)
+"""CESNET OpenID remote app for REST clients."""
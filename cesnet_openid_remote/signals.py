@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Signals sent by CESNET-OpenID-Remote."""
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+login_timed = _signals.signal("cesnet-openid-remote-login-timed")
+"""Signal sent at the end of a request in which a login was timed.
+
+Sent with the application as sender and the
+:class:`cesnet_openid_remote.metrics.LoginTiming` as ``timing``. Only sent
+when ``OAUTHCLIENT_CESNET_OPENID_METRICS`` is enabled.
+"""
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Coordination of Perun group synchronizations."""
+
+import hashlib
+import json
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app
+from invenio_db import db
+from sqlalchemy import text
+
+from .mapping import get_mapping_version
+from .utils import request_scope
+
+FINGERPRINT_KEY = "perun_sync_fingerprint"
+"""Key of the sync fingerprint in the ``extra_data`` of the remote account."""
+
+ADVISORY_LOCK_NAMESPACE = 0x4345534E
+"""First key of the PostgreSQL advisory locks of user syncs (the second is the
+user id)."""
+
+
+def sync_fingerprint(perun_groups):
+    """Return a stable hash of the entitlements and the mapping version."""
+    payload = json.dumps([get_mapping_version() or "", sorted(perun_groups)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_synced(remote_account, fingerprint):
+    """Return True if the remote account was last synced with the fingerprint."""
+    if remote_account is None:
+        return False
+    return (remote_account.extra_data or {}).get(FINGERPRINT_KEY) == fingerprint
+
+
+def has_fingerprint(remote_account):
+    """Return True if the sync of the remote account may be skipped."""
+    if remote_account is None:
+        return False
+    return FINGERPRINT_KEY in (remote_account.extra_data or {})
+
+
+def store_fingerprint(remote_account, fingerprint):
+    """Remember the fingerprint of a finished sync."""
+    # an empty extra_data marks the first login with the remote, which has to
+    # reach account_setup, so the fingerprint is stored only after that
+    if remote_account is None or not remote_account.extra_data:
+        return
+    remote_account.extra_data = {
+        **remote_account.extra_data,
+        FINGERPRINT_KEY: fingerprint,
+    }
+
+
+def reset_fingerprint(remote_account):
+    """Force a full sync on the next login."""
+    if FINGERPRINT_KEY in (remote_account.extra_data or {}):
+        extra_data = dict(remote_account.extra_data)
+        del extra_data[FINGERPRINT_KEY]
+        remote_account.extra_data = extra_data
+
+
+@contextmanager
+def advisory_lock(user_id):
+    """Serialize the syncs of a user across workers (PostgreSQL only).
+
+    The lock is bound to the transaction, it is released when the sync
+    commits its changes (or when the transaction ends otherwise).
+    """
+    if (
+        current_app.config["OAUTHCLIENT_CESNET_OPENID_SYNC_ADVISORY_LOCK"]
+        and db.engine.dialect.name == "postgresql"
+    ):
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :user_id)"),
+            {"namespace": ADVISORY_LOCK_NAMESPACE, "user_id": user_id},
+        )
+    yield
+
+
+class _Flight:
+    """A sync in progress whose result is shared with the waiting callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SyncCoordinator:
+    """Makes sure the Perun groups of a user are synced once per login.
+
+    Both ``account_setup`` and the ``account_info_received`` signal trigger a
+    sync during the same OAuth callback. The first call runs the sync and
+    stores its result in the request scope, later calls for the same user
+    reuse it. Outside of a request every call runs the sync.
+
+    Concurrent logins of the same user (several tabs, retried redirects)
+    are coalesced: while a sync of the user runs in the worker, other
+    threads wait for it and share its result instead of racing on the same
+    memberships. With ``OAUTHCLIENT_CESNET_OPENID_SYNC_ADVISORY_LOCK`` the
+    syncs of a user are serialized across workers too; the later ones then
+    find the user already synced.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def run(self, user, sync):
+        """Run ``sync()`` for the user unless it already ran in this request."""
+        scope = request_scope()
+        if scope is None:
+            return self._single_flight(user.id, sync)
+
+        results = scope.setdefault("perun_sync", {})
+        if user.id in results:
+            self._count("reused")
+            return results[user.id]
+
+        results[user.id] = result = self._single_flight(user.id, sync)
+        return result
+
+    def _single_flight(self, user_id, sync):
+        with self._lock:
+            flight = self._flights.get(user_id)
+            leader = flight is None
+            if leader:
+                flight = self._flights[user_id] = _Flight()
+
+        if not leader:
+            timeout = current_app.config["OAUTHCLIENT_CESNET_OPENID_SYNC_WAIT_TIMEOUT"]
+            if flight.done.wait(timeout):
+                self._count("coalesced")
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            # the running sync is stuck, do not wait for it any longer
+            self._count("runs")
+            with advisory_lock(user_id):
+                return sync()
+
+        self._count("runs")
+        try:
+            with advisory_lock(user_id):
+                flight.result = sync()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[user_id]
+            flight.done.set()
+        return flight.result
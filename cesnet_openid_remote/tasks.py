@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Celery tasks for CESNET-OpenID-Remote."""
+
+import uuid
+
+from celery import shared_task
+from flask import current_app
+from invenio_accounts.models import User
+from invenio_cache import current_cache
+from invenio_db import db
+from werkzeug.exceptions import Forbidden
+
+from .sync import sync_fingerprint
+
+SNAPSHOT_CACHE_KEY = "cesnet_openid_remote:sync_snapshot:{}"
+
+
+def schedule_perun_groups_sync(
+    user, perun_groups, client_id=None, force=False, stale=False
+):
+    """Sync the user's Perun groups in a background task.
+
+    When the user logs in again before the task runs, only the task with the
+    latest entitlement snapshot does the sync (last write wins). ``stale``
+    groups (the last known ones, Perun being unavailable) only add memberships.
+    """
+    snapshot_id = uuid.uuid4().hex
+    current_cache.set(
+        SNAPSHOT_CACHE_KEY.format(user.id),
+        {"id": snapshot_id, "fingerprint": sync_fingerprint(perun_groups)},
+        timeout=current_app.config["OAUTHCLIENT_CESNET_OPENID_SYNC_SNAPSHOT_TIMEOUT"],
+    )
+    sync_perun_groups_task.delay(
+        user.id,
+        sorted(perun_groups),
+        snapshot_id,
+        client_id=client_id,
+        force=force,
+        stale=stale,
+    )
+
+
+def get_pending_snapshot(user_id):
+    """Return ``{"id", "fingerprint"}`` of the latest sync scheduled for the user."""
+    snapshot = current_cache.get(SNAPSHOT_CACHE_KEY.format(user_id))
+    return snapshot if isinstance(snapshot, dict) else None
+
+
+def get_pending_fingerprint(user_id):
+    """Return the fingerprint of the latest sync scheduled for the user, if any."""
+    snapshot = get_pending_snapshot(user_id)
+    return snapshot["fingerprint"] if snapshot else None
+
+
+@shared_task(ignore_result=True)
+def sync_perun_groups_task(
+    user_id, perun_groups, snapshot_id, client_id=None, force=False, stale=False
+):
+    """Sync the Perun groups of a user with their community memberships."""
+    from .communities import sync_user_perun_groups
+
+    snapshot = get_pending_snapshot(user_id)
+    if snapshot is None or snapshot["id"] != snapshot_id:
+        # a newer snapshot has been scheduled for the user
+        return
+
+    user = User.query.get(user_id)
+    if user is None:
+        return
+
+    try:
+        sync_user_perun_groups(user, set(perun_groups), client_id, force, stale)
+    except Forbidden as e:
+        current_app.logger.warning(f"Perun groups of user {user_id} not synced: {e}")
+        db.session.rollback()
+        return
+    db.session.commit()
+
+
+@shared_task(ignore_result=True)
+def recompute_community_memberships(community_id, aai_groups):
+    """Sync the memberships of a community after its mapping changed."""
+    from .reconcile import recompute_community
+
+    stats = recompute_community(community_id, aai_groups)
+    current_app.logger.info(
+        f"Recomputed memberships of community {community_id}: {dict(stats)}"
+    )
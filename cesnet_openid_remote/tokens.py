@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Verification of id_tokens issued by the CESNET OIDC provider."""
+
+import threading
+import time
+from collections import Counter
+
+import jwt
+from flask import current_app
+
+from .metrics import count
+from .utils import request_scope
+
+
+def fetch_jwks(url):
+    """Download the JSON Web Key Set of the provider."""
+    from .proxies import current_cesnet_openid
+
+    count("http_calls")
+    response = current_cesnet_openid.http.get(
+        url, read_timeout=current_app.config["OAUTHCLIENT_CESNET_OPENID_JWKS_TIMEOUT"]
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+class JWKSKeyCache:
+    """Signing keys of the provider cached by ``kid``.
+
+    The key set is downloaded on first use and again once it is older than
+    ``OAUTHCLIENT_CESNET_OPENID_JWKS_TTL``. A token signed by an unknown key
+    triggers an early download to pick up rotated keys, at most once per
+    ``OAUTHCLIENT_CESNET_OPENID_JWKS_MIN_REFRESH_INTERVAL`` seconds.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        self.stats = Counter()
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Download the key set."""
+        jwks = fetch_jwks(current_app.config["OAUTHCLIENT_CESNET_OPENID_JWKS_URL"])
+        self._keys = {key.key_id: key for key in jwt.PyJWKSet.from_dict(jwks).keys}
+        self._fetched_at = time.monotonic()
+        self.stats["fetches"] += 1
+
+    def _age(self):
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def _find(self, kid):
+        if kid is None and len(self._keys) == 1:
+            return next(iter(self._keys.values()))
+        return self._keys.get(kid)
+
+    def get_key(self, kid):
+        """Return the :class:`jwt.PyJWK` with the given key id."""
+        config = current_app.config
+        with self._lock:
+            age = self._age()
+            if age is None or age > config["OAUTHCLIENT_CESNET_OPENID_JWKS_TTL"]:
+                self.refresh()
+                age = 0
+
+            key = self._find(kid)
+            if key is not None:
+                self.stats["hits"] += 1
+                return key
+
+            self.stats["misses"] += 1
+            if age > config["OAUTHCLIENT_CESNET_OPENID_JWKS_MIN_REFRESH_INTERVAL"]:
+                self.refresh()
+                key = self._find(kid)
+            if key is None:
+                raise jwt.InvalidTokenError(f"Unknown signing key {kid!r}.")
+            return key
+
+
+def decode_id_token(remote, resp):
+    """Verify the id_token of the authorized response and return its claims.
+
+    The claims are memoized for the current request, so the token is
+    verified only once even if several handlers need it.
+    """
+    from .proxies import current_cesnet_openid
+
+    id_token = resp["id_token"]
+    scope = request_scope()
+    claims_cache = {} if scope is None else scope.setdefault("id_token_claims", {})
+    if id_token in claims_cache:
+        return claims_cache[id_token]
+
+    config = current_app.config
+    kid = jwt.get_unverified_header(id_token).get("kid")
+    key = current_cesnet_openid.jwks.get_key(kid)
+    claims = jwt.decode(
+        id_token,
+        key.key,
+        algorithms=config["OAUTHCLIENT_CESNET_OPENID_ID_TOKEN_ALGORITHMS"],
+        audience=remote.consumer_key,
+        issuer=config["OAUTHCLIENT_CESNET_OPENID_ISSUER"],
+        leeway=config["OAUTHCLIENT_CESNET_OPENID_ID_TOKEN_LEEWAY"],
+    )
+    claims_cache[id_token] = claims
+    return claims
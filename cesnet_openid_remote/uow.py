@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Unit of work indexing records in bulk."""
+
+from collections import defaultdict
+
+from invenio_records_resources.services.uow import (
+    IndexRefreshOp,
+    RecordCommitOp,
+    RecordDeleteOp,
+    UnitOfWork,
+)
+from invenio_search.engine import search
+
+from .metrics import count
+
+
+class BulkIndexUnitOfWork(UnitOfWork):
+    """Unit of work indexing all its records with a single bulk request.
+
+    Records committed or deleted through ``RecordCommitOp``/``RecordDeleteOp``
+    are sent to the search engine in one bulk request per client after the
+    transaction is committed, and each index is refreshed at most once.
+    """
+
+    def __init__(self, session=None):
+        """Initialize unit of work context."""
+        super().__init__(session)
+        self._bulk = []
+        self._refreshed = set()
+
+    def register(self, op):
+        """Register an operation."""
+        if type(op) in (RecordCommitOp, RecordDeleteOp) and op._indexer is not None:
+            op.on_register(self)
+            op_type = "delete" if isinstance(op, RecordDeleteOp) else "index"
+            self._bulk.append((op._indexer, op_type, op._record))
+            return
+
+        if type(op) is IndexRefreshOp:
+            key = (id(op._indexer), str(op._index))
+            if key in self._refreshed:
+                return
+            self._refreshed.add(key)
+
+        super().register(op)
+
+    def _bulk_actions(self):
+        actions = defaultdict(list)
+        for indexer, op_type, record in self._bulk:
+            index = indexer._prepare_index(indexer.record_to_index(record))
+            action = {
+                "_op_type": op_type,
+                "_index": index,
+                "_id": str(record.id),
+                "_version": record.revision_id,
+                "_version_type": indexer._version_type,
+            }
+            if op_type == "index":
+                action["_source"] = indexer._prepare_record(record, index)
+            actions[indexer.client].append(action)
+        return actions
+
+    def commit(self):
+        """Commit the unit of work."""
+        self.session.commit()
+        for client, actions in self._bulk_actions().items():
+            search.helpers.bulk(client, actions)
+            count("search_requests")
+        for op in self._operations:
+            op.on_commit(self)
+        for op in self._operations:
+            op.on_post_commit(self)
+        self._mark_dirty()
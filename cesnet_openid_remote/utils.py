@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Utilities for CESNET-OpenID-Remote."""
+
+from flask import (
+    copy_current_request_context,
+    current_app,
+    g,
+    has_request_context,
+    request,
+)
+
+
+def request_scope():
+    """Return a dict living as long as the current request.
+
+    The dict is stored in the WSGI environ, so it is not shared between
+    requests even if they run in the same application context (e.g. tests).
+    Returns ``None`` outside of a request.
+    """
+    if not has_request_context():
+        return None
+    return request.environ.setdefault("cesnet_openid_remote", {})
+
+
+def is_copied_context():
+    """Return True in a request context copied by :func:`submit_in_context`."""
+    return g.get("cesnet_openid_remote_copied_context", False)
+
+
+def submit_in_context(executor, f, *args, **kwargs):
+    """Run ``f`` in the executor within a copy of the current request context.
+
+    Outside of a request, ``f`` runs within the current app context.
+    """
+    if has_request_context():
+
+        @copy_current_request_context
+        def in_request_context(*args, **kwargs):
+            g.cesnet_openid_remote_copied_context = True
+            return f(*args, **kwargs)
+
+        return executor.submit(in_request_context, *args, **kwargs)
+
+    app = current_app._get_current_object()
+
+    def in_app_context(*args, **kwargs):
+        with app.app_context():
+            return f(*args, **kwargs)
+
+    return executor.submit(in_app_context, *args, **kwargs)
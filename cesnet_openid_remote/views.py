@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2023 CESNET.
+#
+# CESNET-OpenID-Remote is free software; you can redistribute it and/or
+# modify it under the terms of the MIT License; see LICENSE file for more
+# details.
+
+"""Views of CESNET-OpenID-Remote."""
+
+import hmac
+
+from flask import Blueprint, abort, current_app, request
+
+from .proxies import current_cesnet_openid
+
+
+def metrics():
+    """Export the metrics of the configured sink, if it can export them.
+
+    The endpoint is disabled unless a token is configured, the token has to be
+    sent as ``Authorization: Bearer <token>``.
+    """
+    token = current_app.config["OAUTHCLIENT_CESNET_OPENID_METRICS_TOKEN"]
+    sink = current_cesnet_openid.metrics_sink
+    if not token or not hasattr(sink, "export"):
+        abort(404)
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        abort(401)
+    return sink.export(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+def create_blueprint(app):
+    """Create the CESNET-OpenID-Remote blueprint."""
+    blueprint = Blueprint("cesnet_openid_remote", __name__)
+    blueprint.add_url_rule("/cesnet-openid-remote/metrics", view_func=metrics)
+    return blueprint
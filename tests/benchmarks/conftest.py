@@ -0,0 +1,78 @@
+import itertools
+import os
+from unittest.mock import Mock
+
+import pytest
+from invenio_communities.communities.records.api import Community
+
+BENCHMARK_COMMUNITIES = int(os.environ.get("BENCHMARK_COMMUNITIES", 20))
+"""Number of communities with a mapping (N)."""
+
+BENCHMARK_MAPPING_ENTRIES = int(os.environ.get("BENCHMARK_MAPPING_ENTRIES", 5))
+"""Number of mapping entries per community (M)."""
+
+BENCHMARK_ENTITLEMENTS = int(os.environ.get("BENCHMARK_ENTITLEMENTS", 10))
+"""Number of entitlements of a user (K), half of them mapped."""
+
+
+def aai_group(community, entry):
+    return f"urn:geant:cesnet.cz:group:bench:{community}:{entry}#perun.cesnet.cz"
+
+
+def aai_mapping(community):
+    return [
+        {"aai_group": aai_group(community, entry), "role": "reader"}
+        for entry in range(BENCHMARK_MAPPING_ENTRIES)
+    ]
+
+
+def user_entitlements(offset=0):
+    """K entitlements, half of them mapped to communities starting at offset."""
+    mapped = BENCHMARK_ENTITLEMENTS // 2
+    return {
+        aai_group((offset + i) % BENCHMARK_COMMUNITIES, i % BENCHMARK_MAPPING_ENTRIES)
+        for i in range(mapped)
+    } | {
+        f"urn:geant:cesnet.cz:group:unmapped:{i}#perun.cesnet.cz"
+        for i in range(BENCHMARK_ENTITLEMENTS - mapped)
+    }
+
+
+@pytest.fixture(scope="function")
+def mapped_communities(community_service, users, location, init_cf):
+    """N communities, each with M mapping entries."""
+    communities = [
+        community_service.create(
+            users["owner"].identity,
+            {
+                "access": {"visibility": "public", "record_policy": "open"},
+                "slug": f"bench-{i}",
+                "metadata": {"title": f"Benchmark community {i}"},
+                "custom_fields": {"aai_mapping": aai_mapping(i)},
+            },
+        )
+        for i in range(BENCHMARK_COMMUNITIES)
+    ]
+    Community.index.refresh()
+    return communities
+
+
+@pytest.fixture
+def userinfo_remote():
+    """Mocked remote whose userinfo returns the next of the given entitlements."""
+
+    def _userinfo_remote(*entitlements):
+        entitlements = itertools.cycle(entitlements)
+
+        def _get(url):
+            userinfo = Mock()
+            userinfo.data = {"eduperson_entitlement": sorted(next(entitlements))}
+            return userinfo
+
+        remote = Mock()
+        remote.consumer_key = "333e0e21-83bc-414f-bb4c-6df622fc1331"
+        remote.base_url = "https://login.cesnet.cz/oidc/"
+        remote.get.side_effect = _get
+        return remote
+
+    return _userinfo_remote
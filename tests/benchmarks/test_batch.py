@@ -0,0 +1,89 @@
+import os
+import time
+from collections import defaultdict
+
+import pytest
+
+from cesnet_openid_remote.batch import plan_batch_sync
+from cesnet_openid_remote.communities import plan_user_sync
+from cesnet_openid_remote.patterns import GroupMatcher
+
+from .conftest import BENCHMARK_COMMUNITIES, aai_mapping, user_entitlements
+
+BENCHMARK_USERS = int(os.environ.get("BENCHMARK_USERS", 10000))
+"""Number of users planned at once."""
+
+BENCHMARK_SPEEDUP = bool(os.environ.get("BENCHMARK_SPEEDUP"))
+"""Assert the speedups claimed in the README, run with 100k users."""
+
+PLANNING_SPEEDUP = 5
+"""Claimed speedup of planning a batch, the plans are created on access."""
+
+RECONCILE_SPEEDUP = 2
+"""Claimed speedup of planning a batch and creating the plans of all users, as
+``cesnet:sync --engine batch`` does."""
+
+
+@pytest.fixture(scope="module")
+def users_data():
+    matcher = GroupMatcher(
+        (entry["aai_group"], (f"c{community}", entry["role"]))
+        for community in range(BENCHMARK_COMMUNITIES)
+        for entry in aai_mapping(community)
+    )
+    users_groups = [user_entitlements(offset) for offset in range(BENCHMARK_USERS)]
+    # every other user is in sync already, the others are in another community
+    users_community_roles = [
+        {f"c{(offset + offset % 2) % BENCHMARK_COMMUNITIES}": {"reader"}}
+        for offset in range(BENCHMARK_USERS)
+    ]
+    return users_groups, users_community_roles, matcher
+
+
+def plan_users_one_by_one(users_groups, users_community_roles, matcher):
+    plans = []
+    for perun_groups, community_roles in zip(users_groups, users_community_roles):
+        communities = defaultdict(list)
+        for aai_group, (community_id, role) in matcher.match(perun_groups):
+            communities[community_id].append({"aai_group": aai_group, "role": role})
+        plans.append(plan_user_sync(community_roles, perun_groups, communities))
+    return plans
+
+
+def plan_users_batch_materialized(users_groups, users_community_roles, matcher):
+    return list(plan_batch_sync(users_groups, users_community_roles, matcher))
+
+
+@pytest.mark.parametrize(
+    "planner",
+    [plan_users_one_by_one, plan_batch_sync, plan_users_batch_materialized],
+    ids=["python", "batch", "batch-materialized"],
+)
+def test_plan_users(users_data, planner, benchmark):
+    plans = benchmark(planner, *users_data)
+    assert len(plans) == BENCHMARK_USERS
+
+
+def best_time(f, *args, rounds=3):
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+@pytest.mark.skipif(
+    not BENCHMARK_SPEEDUP, reason="set BENCHMARK_SPEEDUP to assert the speedups"
+)
+@pytest.mark.parametrize(
+    "planner,speedup",
+    [
+        (plan_batch_sync, PLANNING_SPEEDUP),
+        (plan_users_batch_materialized, RECONCILE_SPEEDUP),
+    ],
+    ids=["batch", "batch-materialized"],
+)
+def test_batch_speedup(users_data, planner, speedup):
+    one_by_one = best_time(plan_users_one_by_one, *users_data)
+    assert one_by_one / best_time(planner, *users_data) >= speedup
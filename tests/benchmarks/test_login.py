@@ -0,0 +1,86 @@
+import itertools
+
+import pytest
+
+from cesnet_openid_remote.communities import (
+    get_mapped_communities,
+    link_perun_groups,
+    split_user_roles,
+)
+from cesnet_openid_remote.remote import autocreate_user
+
+from .conftest import (
+    BENCHMARK_COMMUNITIES,
+    BENCHMARK_ENTITLEMENTS,
+    aai_mapping,
+    user_entitlements,
+)
+
+
+def test_split_user_roles(benchmark):
+    mapping = aai_mapping(0)
+    perun_groups = user_entitlements()
+
+    kept_roles, added_roles, removed_roles = benchmark(
+        split_user_roles, mapping, {"reader", "curator"}, perun_groups
+    )
+    assert kept_roles == {"reader"}
+    assert removed_roles == {"curator"}
+
+
+@pytest.mark.parametrize("mapping_index", [False, True])
+def test_get_mapped_communities(
+    app, db, mapped_communities, mapping_index, monkeypatch, benchmark
+):
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX", mapping_index
+    )
+    perun_groups = user_entitlements()
+
+    communities = benchmark(get_mapped_communities, perun_groups)
+    assert len(communities) == min(BENCHMARK_ENTITLEMENTS // 2, BENCHMARK_COMMUNITIES)
+
+
+def test_link_perun_groups(
+    db, mapped_communities, users, userinfo_remote, search_clear, benchmark
+):
+    # every round moves the user to other communities, so all of them write
+    remote = userinfo_remote(
+        user_entitlements(), user_entitlements(BENCHMARK_COMMUNITIES // 2)
+    )
+    user = users["reader"].user
+
+    benchmark.pedantic(link_perun_groups, args=(remote, user), rounds=10)
+    assert remote.get.call_count == 10
+
+
+def test_autocreate_new_user(db, benchmark):
+    ids = itertools.count()
+
+    def new_account_info():
+        i = next(ids)
+        account_info = {
+            "external_id": f"bench-sub-{i}",
+            "external_method": "perun",
+            "user": {
+                "email": f"bench-{i}@example.org",
+                "profile": {"full_name": f"Benchmark User {i}"},
+            },
+        }
+        return (None,), {"account_info": account_info}
+
+    benchmark.pedantic(autocreate_user, setup=new_account_info, rounds=20)
+
+
+def test_autocreate_returning_user(db, benchmark):
+    account_info = {
+        "external_id": "bench-sub",
+        "external_method": "perun",
+        "user": {
+            "email": "bench@example.org",
+            "profile": {"full_name": "Benchmark User"},
+        },
+    }
+    autocreate_user(None, account_info=account_info)
+
+    benchmark(autocreate_user, None, account_info=account_info)
@@ -1,16 +1,25 @@
 import copy
+import json
 import os
+import time
 from unittest.mock import Mock
 
+import jwt
 import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
 from invenio_access.permissions import system_identity
 from invenio_app.factory import create_api
 from invenio_communities.cli import create_communities_custom_field
 from invenio_communities.communities.records.api import Community
+from invenio_communities.communities.services.components import (
+    DefaultCommunityComponents,
+)
 from invenio_communities.proxies import current_communities
 from oarepo_communities.cf.aai import AAIMappingCF
 
-from cesnet_openid_remote import remote
+from cesnet_openid_remote import remote, tokens
+from cesnet_openid_remote.components import AAIMappingComponent
+from cesnet_openid_remote.tokens import JWKSKeyCache
 
 
 @pytest.fixture(scope="module")
@@ -36,16 +45,20 @@ def member_service(community_service):
 def app_config(app_config):
     # Custom fields
     app_config["JSONSCHEMAS_HOST"] = "localhost"
-    app_config[
-        "RECORDS_REFRESOLVER_CLS"
-    ] = "invenio_records.resolver.InvenioRefResolver"
-    app_config[
-        "RECORDS_REFRESOLVER_STORE"
-    ] = "invenio_jsonschemas.proxies.current_refresolver_store"
+    app_config["RECORDS_REFRESOLVER_CLS"] = (
+        "invenio_records.resolver.InvenioRefResolver"
+    )
+    app_config["RECORDS_REFRESOLVER_STORE"] = (
+        "invenio_jsonschemas.proxies.current_refresolver_store"
+    )
 
     app_config["COMMUNITIES_CUSTOM_FIELDS"] = [
         AAIMappingCF("aai_mapping"),
     ]
+    app_config["COMMUNITIES_SERVICE_COMPONENTS"] = [
+        *DefaultCommunityComponents,
+        AAIMappingComponent,
+    ]
     app_config["SEARCH_HOSTS"] = [
         {
             "host": os.environ.get("OPENSEARCH_HOST", "localhost"),
@@ -236,3 +249,47 @@ def return_userinfo_noone():
             return usrinfo_obj
 
     return _return_userinfo
+
+
+@pytest.fixture(scope="module")
+def rsa_private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture(scope="module")
+def jwks(rsa_private_key):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(rsa_private_key.public_key()))
+    jwk.update({"kid": "test-key", "use": "sig", "alg": "RS256"})
+    return {"keys": [jwk]}
+
+
+@pytest.fixture
+def local_jwks(app, jwks, monkeypatch):
+    """Serve the local key set instead of the provider's one."""
+    fetched = []
+
+    def _fetch_jwks(url):
+        fetched.append(url)
+        return jwks
+
+    monkeypatch.setattr(tokens, "fetch_jwks", _fetch_jwks)
+    monkeypatch.setattr(app.extensions["cesnet-openid-remote"], "jwks", JWKSKeyCache())
+    return fetched
+
+
+@pytest.fixture
+def sign_id_token(rsa_private_key):
+    def _sign_id_token(claims, kid="test-key", key=None):
+        now = int(time.time())
+        claims = {
+            "iss": "https://login.cesnet.cz/oidc/",
+            "aud": "lalala",
+            "iat": now,
+            "exp": now + 300,
+            **claims,
+        }
+        return jwt.encode(
+            claims, key or rsa_private_key, algorithm="RS256", headers={"kid": kid}
+        )
+
+    return _sign_id_token
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+from invenio_communities.communities.records.api import Community
+
+from cesnet_openid_remote.remote_app import cesnet_remote_app
+
+from .provider import StubOIDCProvider
+
+LOADTEST_LOGINS = int(os.environ.get("LOADTEST_LOGINS", 0))
+"""Number of logins, the load test is skipped when not set."""
+
+LOADTEST_CONCURRENCY = int(os.environ.get("LOADTEST_CONCURRENCY", 8))
+"""Number of logins running at the same time."""
+
+LOADTEST_COMMUNITIES = int(os.environ.get("LOADTEST_COMMUNITIES", 50))
+"""Number of seeded communities, each mapped to one Perun group."""
+
+LOADTEST_ENTITLEMENTS = int(os.environ.get("LOADTEST_ENTITLEMENTS", 5))
+"""Number of mapped entitlements of each user."""
+
+LOADTEST_LATENCY = float(os.environ.get("LOADTEST_LATENCY", 0.05))
+"""Latency (in seconds) of the stub token and userinfo endpoints."""
+
+LOADTEST_REPORT = os.environ.get("LOADTEST_REPORT")
+"""Path of the JSON report, if any."""
+
+
+def aai_group(community):
+    return f"urn:geant:cesnet.cz:group:loadtest:{community}#perun.cesnet.cz"
+
+
+def user_entitlements(sub):
+    n = int(sub.rsplit("-", 1)[-1])
+    return [
+        aai_group((n + i) % LOADTEST_COMMUNITIES) for i in range(LOADTEST_ENTITLEMENTS)
+    ]
+
+
+@pytest.fixture(scope="module")
+def stub_provider(rsa_private_key, jwks):
+    provider = StubOIDCProvider(
+        rsa_private_key,
+        jwks,
+        audience="lalala",
+        entitlements=user_entitlements,
+        latency=LOADTEST_LATENCY,
+    ).start()
+    yield provider
+    provider.stop()
+
+
+@pytest.fixture(scope="module")
+def app_config(app_config, stub_provider):
+    app_config["OAUTHCLIENT_REST_REMOTE_APPS"] = {
+        "eduid": cesnet_remote_app(stub_provider.url, rest=True)
+    }
+    app_config["PERUN_APP_CREDENTIALS_CONSUMER_SECRET"] = "secret"
+    app_config["OAUTHCLIENT_CESNET_OPENID_ISSUER"] = stub_provider.url
+    app_config["OAUTHCLIENT_CESNET_OPENID_JWKS_URL"] = f"{stub_provider.url}jwk"
+    app_config["OAUTHCLIENT_CESNET_OPENID_METRICS"] = True
+    return app_config
+
+
+@pytest.fixture(scope="function")
+def seeded_communities(community_service, users, location, init_cf):
+    """Communities mapped to the Perun groups the users are members of."""
+    communities = [
+        community_service.create(
+            users["owner"].identity,
+            {
+                "access": {"visibility": "public", "record_policy": "open"},
+                "slug": f"loadtest-{i}",
+                "metadata": {"title": f"Load test community {i}"},
+                "custom_fields": {
+                    "aai_mapping": [{"aai_group": aai_group(i), "role": "reader"}]
+                },
+            },
+        )
+        for i in range(LOADTEST_COMMUNITIES)
+    ]
+    Community.index.refresh()
+    return communities
@@ -0,0 +1,105 @@
+"""Stand-in of the CESNET OIDC provider for load tests."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import jwt
+
+
+class StubOIDCHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        provider = self.server.provider
+        if self.path == "/oidc/jwk":
+            return self.send_json(provider.jwks)
+        if self.path == "/oidc/userinfo":
+            access_token = self.headers.get("Authorization", "").split(" ")[-1]
+            user = provider.users_by_token.get(access_token)
+            if user is None:
+                return self.send_json({"error": "invalid_token"}, status=401)
+            time.sleep(provider.latency)
+            return self.send_json(
+                {"sub": user, "eduperson_entitlement": provider.entitlements(user)}
+            )
+        self.send_json({"error": "not_found"}, status=404)
+
+    def do_POST(self):
+        provider = self.server.provider
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if self.path != "/oidc/token" or "code" not in form:
+            return self.send_json({"error": "invalid_request"}, status=400)
+        time.sleep(provider.latency)
+        self.send_json(provider.token(form["code"][0]))
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOIDCProvider:
+    """Token, userinfo and JWKS endpoints issuing tokens for any code.
+
+    The authorization code is the ``sub`` of the user logging in, the user's
+    entitlements are given by the ``entitlements(sub)`` callable.
+    """
+
+    def __init__(
+        self, private_key, jwks, audience, entitlements, latency=0.0, kid="test-key"
+    ):
+        self.private_key = private_key
+        self.jwks = jwks
+        self.audience = audience
+        self.entitlements = entitlements
+        self.latency = latency
+        self.kid = kid
+        self.users_by_token = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), StubOIDCHandler)
+        self._server.daemon_threads = True
+        self._server.provider = self
+        self.url = f"http://127.0.0.1:{self._server.server_port}/oidc/"
+
+    def token(self, sub):
+        now = int(time.time())
+        access_token = f"access-{sub}"
+        self.users_by_token[access_token] = sub
+        id_token = jwt.encode(
+            {
+                "iss": self.url,
+                "aud": self.audience,
+                "iat": now,
+                "exp": now + 300,
+                "sub": sub,
+                "email": f"{sub}@loadtest.example.org",
+                "name": f"Load Test {sub}",
+            },
+            self.private_key,
+            algorithm="RS256",
+            headers={"kid": self.kid},
+        )
+        return {
+            "access_token": access_token,
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "scope": "openid profile email eduperson_entitlement",
+            "id_token": id_token,
+        }
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,81 @@
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from cesnet_openid_remote.signals import login_timed
+
+from .conftest import LOADTEST_CONCURRENCY, LOADTEST_LOGINS, LOADTEST_REPORT
+
+pytestmark = pytest.mark.skipif(
+    not LOADTEST_LOGINS, reason="set LOADTEST_LOGINS to run the load test"
+)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of the values."""
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def summary(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def login(app, sub):
+    """Run the whole OAuth flow of the user, return its latency."""
+    client = app.test_client()
+    started = time.perf_counter()
+    resp = client.get("/oauth/login/eduid/")
+    assert resp.status_code == 302
+    state = parse_qs(urlsplit(resp.headers["Location"]).query)["state"][0]
+    resp = client.get(f"/oauth/authorized/eduid/?code={sub}&state={state}")
+    latency = time.perf_counter() - started
+    assert resp.status_code == 302
+    assert parse_qs(urlsplit(resp.headers["Location"]).query)["code"] == ["200"]
+    return latency
+
+
+def test_concurrent_logins(app, seeded_communities, search_clear):
+    timings = []
+    lock = threading.Lock()
+
+    def receiver(sender, timing):
+        with lock:
+            timings.append(timing.as_dict())
+
+    with login_timed.connected_to(receiver, sender=app):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(LOADTEST_CONCURRENCY) as executor:
+            latencies = list(
+                executor.map(lambda n: login(app, f"user-{n}"), range(LOADTEST_LOGINS))
+            )
+        elapsed = time.perf_counter() - started
+
+    phases = {}
+    for timing in timings:
+        for name, seconds in timing["phases"].items():
+            phases.setdefault(name, []).append(seconds)
+    report = {
+        "logins": LOADTEST_LOGINS,
+        "concurrency": LOADTEST_CONCURRENCY,
+        "throughput": LOADTEST_LOGINS / elapsed,
+        "latency": summary(latencies),
+        "phases": {name: summary(values) for name, values in sorted(phases.items())},
+    }
+
+    if LOADTEST_REPORT:
+        with open(LOADTEST_REPORT, "w") as f:
+            json.dump(report, f, indent=2)
+
+    assert len(latencies) == LOADTEST_LOGINS
+    assert timings
@@ -0,0 +1,105 @@
+import random
+from collections import defaultdict
+
+import pytest
+
+from cesnet_openid_remote.batch import plan_batch_sync
+from cesnet_openid_remote.communities import plan_user_sync
+from cesnet_openid_remote.patterns import GroupMatcher
+
+ROLES = ["reader", "curator", "manager"]
+
+
+def lookup(matcher, perun_groups):
+    """Same as AAIMappingIndex.lookup."""
+    ret = defaultdict(list)
+    for aai_group, (community_id, role) in matcher.match(perun_groups):
+        ret[community_id].append({"aai_group": aai_group, "role": role})
+    return dict(ret)
+
+
+def random_users(rnd, n_users, n_communities, n_groups):
+    entries = []
+    for community in range(n_communities):
+        for _ in range(rnd.randint(0, 3)):
+            entries.append(
+                (
+                    f"urn:test:{rnd.randrange(n_groups)}#perun",
+                    (f"c{community}", rnd.choice(ROLES)),
+                )
+            )
+        if rnd.random() < 0.1:
+            entries.append(
+                (f"urn:test:{rnd.randrange(n_groups)}#*", (f"c{community}", "reader"))
+            )
+    users_groups = [
+        {f"urn:test:{rnd.randrange(n_groups)}#perun" for _ in range(rnd.randint(0, 6))}
+        | {f"urn:test:{rnd.randrange(n_groups)}:sub#perun"}
+        for _ in range(n_users)
+    ]
+    users_community_roles = [
+        {
+            f"c{rnd.randrange(n_communities)}": set(
+                rnd.sample(ROLES, rnd.randint(1, 2))
+            )
+            for _ in range(rnd.randint(0, 3))
+        }
+        for _ in range(n_users)
+    ]
+    return users_groups, users_community_roles, GroupMatcher(entries)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_plan_batch_sync_same_as_plan_user_sync(seed):
+    users_groups, users_community_roles, matcher = random_users(
+        random.Random(seed), 200, 30, 60
+    )
+
+    plans = plan_batch_sync(users_groups, users_community_roles, matcher)
+
+    assert len(plans) == len(users_groups)
+    for perun_groups, community_roles, plan in zip(
+        users_groups, users_community_roles, plans
+    ):
+        expected = plan_user_sync(
+            community_roles, perun_groups, lookup(matcher, perun_groups)
+        )
+        assert sorted(plan.add) == sorted(expected.add)
+        assert sorted(plan.remove) == sorted(expected.remove)
+        assert plan.conflicts == expected.conflicts
+
+
+def test_plan_batch_sync():
+    matcher = GroupMatcher(
+        [
+            ("new:curator", ("new", "curator")),
+            ("kept:reader", ("kept", "reader")),
+            ("changed:curator", ("changed", "curator")),
+            ("conflict:curator", ("conflict", "curator")),
+            ("conflict:reader", ("conflict", "reader")),
+        ]
+    )
+    users_groups = [
+        {"new:curator", "kept:reader", "changed:curator", "conflict:curator"},
+        {"conflict:curator", "conflict:reader"},
+        set(),
+    ]
+    users_community_roles = [
+        {"kept": {"reader"}, "changed": {"reader"}, "gone": {"curator"}},
+        {},
+        {},
+    ]
+
+    plans = plan_batch_sync(users_groups, users_community_roles, matcher)
+
+    assert sorted(plans[0].add) == [
+        ("changed", "curator"),
+        ("conflict", "curator"),
+        ("new", "curator"),
+    ]
+    assert sorted(plans[0].remove) == ["changed", "gone"]
+    assert plans[0].conflicts == {}
+    assert plans[1].conflicts == {"conflict": {"curator", "reader"}}
+    assert plans[1].add == plans[1].remove == []
+    assert plans[2] == ([], [], {})
+    assert list(plans) == [plans[0], plans[1], plans[2]]
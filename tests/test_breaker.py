@@ -0,0 +1,152 @@
+from unittest.mock import Mock
+
+import pytest
+import requests
+from flask_oauthlib.client import OAuthException
+
+from cesnet_openid_remote.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from cesnet_openid_remote.communities import get_user_perun_groups, link_perun_groups
+from cesnet_openid_remote.errors import EntitlementsUnavailable
+
+from .test_entitlements import Clock
+from .test_perun_groups import get_user_community_roles, set_remote
+
+
+@pytest.fixture
+def breaker(app, monkeypatch):
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_USERINFO_BREAKER_THRESHOLD", 2
+    )
+    breaker = CircuitBreaker("userinfo", clock=Clock())
+    monkeypatch.setattr(
+        app.extensions["cesnet-openid-remote"], "userinfo_breaker", breaker
+    )
+    return breaker
+
+
+def test_breaker_opens_and_recovers(app, breaker):
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    breaker._clock.now = 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # a single probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    breaker._clock.now = 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_expires(app, breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker._clock.now = 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+    # the probe never reported its result
+    breaker._clock.now = 59
+    assert not breaker.allow()
+    breaker._clock.now = 60
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_unexpected_probe_error_expires(app, breaker, monkeypatch):
+    def broken(url):
+        raise ValueError("unexpected")
+
+    remote = set_remote(broken, monkeypatch)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker._clock.now = 30
+    with pytest.raises(ValueError):
+        get_user_perun_groups(remote)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker._clock.now = 60
+    assert breaker.allow()
+
+
+def test_user_errors_do_not_open(app, breaker, monkeypatch):
+    def invalid_token(url):
+        return Mock(status=401, data={"error": "invalid_token"})
+
+    remote = set_remote(invalid_token, monkeypatch)
+    for _ in range(3):
+        with pytest.raises(EntitlementsUnavailable):
+            get_user_perun_groups(remote)
+    assert breaker.state == CLOSED
+    assert remote.get.call_count == 3
+
+    def missing_token(url):
+        raise OAuthException("No token available", type="token_missing")
+
+    remote.get.side_effect = missing_token
+    for _ in range(3):
+        with pytest.raises(EntitlementsUnavailable):
+            get_user_perun_groups(remote)
+    assert breaker.state == CLOSED
+
+
+def test_server_errors_open(app, breaker, monkeypatch):
+    def server_error(url):
+        return Mock(status=503, data="Service Unavailable")
+
+    remote = set_remote(server_error, monkeypatch)
+    for _ in range(2):
+        with pytest.raises(EntitlementsUnavailable):
+            get_user_perun_groups(remote)
+    assert breaker.state == OPEN
+
+
+def test_userinfo_not_called_while_open(app, breaker, monkeypatch):
+    def unavailable(url):
+        raise requests.ConnectionError("Perun is down")
+
+    remote = set_remote(unavailable, monkeypatch)
+    for _ in range(2):
+        with pytest.raises(EntitlementsUnavailable):
+            get_user_perun_groups(remote)
+    with pytest.raises(EntitlementsUnavailable):
+        get_user_perun_groups(remote)
+    assert remote.get.call_count == 2
+
+
+def test_stale_sync_keeps_memberships(
+    db,
+    breaker,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+):
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+    link_perun_groups(remote, user.user)
+    assert len(get_user_community_roles(user.id)) == 1
+
+    def unavailable(url):
+        raise requests.Timeout("Perun is slow")
+
+    remote.get.side_effect = unavailable
+    for _ in range(3):
+        link_perun_groups(remote, user.user)
+
+    roles = get_user_community_roles(user.id)
+    assert len(roles) == 1
+    assert roles[0][1] == "curator"
+    assert breaker.state == OPEN
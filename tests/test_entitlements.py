@@ -0,0 +1,113 @@
+from unittest.mock import Mock
+
+import pytest
+
+from cesnet_openid_remote.communities import get_user_perun_groups, link_perun_groups
+from cesnet_openid_remote.entitlements import LRUEntitlementCache
+from cesnet_openid_remote.errors import EntitlementsUnavailable
+
+from .test_perun_groups import get_user_community_roles, set_remote
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_ttl():
+    clock = Clock()
+    cache = LRUEntitlementCache(ttl=10, maxsize=10, clock=clock)
+    cache.set("sub", {"a", "b"})
+
+    clock.now = 9
+    assert cache.get("sub") == {"a", "b"}
+    clock.now = 10
+    assert cache.get("sub") is None
+
+
+def test_lru_cache_eviction():
+    cache = LRUEntitlementCache(ttl=10, maxsize=2)
+    cache.set("first", {"a"})
+    cache.set("second", {"b"})
+    cache.get("first")
+    cache.set("third", {"c"})
+
+    assert cache.get("first") == {"a"}
+    assert cache.get("second") is None
+    assert cache.get("third") == {"c"}
+
+
+def test_userinfo_not_called_within_ttl(app, return_userinfo_curator, monkeypatch):
+    monkeypatch.setattr(
+        app.extensions["cesnet-openid-remote"],
+        "entitlement_cache",
+        LRUEntitlementCache(ttl=10, maxsize=10),
+    )
+    remote = Mock(base_url="https://login.cesnet.cz/oidc/")
+    remote.get.side_effect = return_userinfo_curator
+
+    assert get_user_perun_groups(remote, sub="user1") == {"test_community:curator"}
+    assert get_user_perun_groups(remote, sub="user1") == {"test_community:curator"}
+    assert remote.get.call_count == 1
+
+    # without the sub the cache can not be used
+    get_user_perun_groups(remote)
+    assert remote.get.call_count == 2
+
+
+def test_entitlements_from_id_token(app, return_userinfo_curator, monkeypatch):
+    remote = Mock(base_url="https://login.cesnet.cz/oidc/")
+    remote.get.side_effect = return_userinfo_curator
+    claims = {"sub": "user1", "eduperson_entitlement": ["from_id_token"]}
+
+    assert get_user_perun_groups(remote, claims=claims) == {"from_id_token"}
+    assert remote.get.call_count == 0
+
+    # the claim is missing, fall back to userinfo
+    assert get_user_perun_groups(remote, claims={"sub": "user1"}) == {
+        "test_community:curator"
+    }
+    assert remote.get.call_count == 1
+
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_SOURCE", "id_token"
+    )
+    with pytest.raises(EntitlementsUnavailable):
+        get_user_perun_groups(remote, claims={"sub": "user1"})
+    with pytest.raises(EntitlementsUnavailable):
+        get_user_perun_groups(remote)
+    assert remote.get.call_count == 1
+
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_SOURCE", "userinfo"
+    )
+    assert get_user_perun_groups(remote, claims=claims) == {"test_community:curator"}
+    assert remote.get.call_count == 2
+
+
+def test_missing_id_token_claim_keeps_memberships(
+    db,
+    app,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+):
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+    link_perun_groups(remote, user.user)
+    assert len(get_user_community_roles(user.id)) == 1
+
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_ENTITLEMENT_SOURCE", "id_token"
+    )
+    link_perun_groups(remote, user.user, claims={"sub": "user1"})
+    link_perun_groups(remote, user.user, force=True)
+
+    roles = get_user_community_roles(user.id)
+    assert len(roles) == 1
+    assert roles[0][1] == "curator"
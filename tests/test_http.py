@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from cesnet_openid_remote.httpclient import PerunHTTPSession, PooledOAuthRemoteApp
+from cesnet_openid_remote.remote import REMOTE_APP
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        status, delay = (200, 0)
+        if self.server.responses:
+            status, delay = self.server.responses.pop(0)
+        time.sleep(delay)
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http(app, monkeypatch):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_HTTP_BACKOFF", 0.01)
+    session = PerunHTTPSession()
+    yield session
+    session.close()
+
+
+def test_connections_reused(app, http, stub_server):
+    url = f"http://127.0.0.1:{stub_server.server_port}/userinfo"
+    for _ in range(3):
+        assert http.get(url).json() == {"path": "/userinfo"}
+
+    stats = http.pool_stats()
+    assert stats["requests"] == 3
+    assert stats["connections_created"] == 1
+    assert stats["connections_reused"] == 2
+
+
+def test_retry_on_unavailable(app, http, stub_server):
+    stub_server.responses = [(503, 0), (502, 0)]
+    url = f"http://127.0.0.1:{stub_server.server_port}/userinfo"
+
+    assert http.get(url).status_code == 200
+    assert http.pool_stats()["retries"] == 2
+
+
+def test_retries_exhausted(app, http, stub_server, monkeypatch):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_HTTP_RETRIES", 1)
+    stub_server.responses = [(503, 0), (503, 0), (200, 0)]
+    url = f"http://127.0.0.1:{stub_server.server_port}/userinfo"
+
+    assert http.get(url).status_code == 503
+
+
+def test_post_not_retried(app, http, stub_server):
+    stub_server.responses = [(503, 0)]
+    url = f"http://127.0.0.1:{stub_server.server_port}/token"
+
+    assert http.request("POST", url).status_code == 503
+    assert http.pool_stats().get("retries", 0) == 0
+
+
+def test_read_timeout_within_deadline(app, http, stub_server, monkeypatch):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_HTTP_READ_TIMEOUT", 0.1)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_HTTP_DEADLINE", 0.5)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_HTTP_RETRIES", 100)
+    stub_server.responses = [(200, 1)] * 100
+    url = f"http://127.0.0.1:{stub_server.server_port}/userinfo"
+
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        http.get(url)
+    assert time.monotonic() - started < 1
+    assert http.pool_stats()["failures"] == 1
+
+
+def test_remote_app_uses_pooled_session(app, stub_server):
+    remote = PooledOAuthRemoteApp(None, "eduid", **REMOTE_APP["params"])
+    url = f"http://127.0.0.1:{stub_server.server_port}/userinfo"
+
+    resp, content = remote.http_request(url, method="GET")
+    assert resp.code == 200
+    assert resp.headers.get("content-type") == "application/json"
+    assert json.loads(content) == {"path": "/userinfo"}
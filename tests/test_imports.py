@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = {
+    "flask_oauthlib",
+    "invenio_accounts",
+    "invenio_communities",
+    "invenio_oauthclient",
+    "invenio_search",
+    "jwt",
+    "numpy",
+    "prometheus_client",
+    "requests",
+    "scipy",
+    "sqlalchemy",
+}
+
+
+def imported_modules(statement):
+    """Return the modules imported by ``statement`` in a fresh interpreter."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"{statement}\nimport sys\nprint('\\n'.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stdout.split())
+
+
+def test_remote_app_import_is_light():
+    modules = imported_modules("from cesnet_openid_remote.remote_app import REMOTE_APP")
+
+    assert "cesnet_openid_remote.remote_app" in modules
+    assert not {name.split(".")[0] for name in modules} & HEAVY_MODULES
+
+
+def test_remote_app_matches_settings_helper():
+    pytest.importorskip("invenio_oauthclient")
+    from cesnet_openid_remote.remote import CesnetOAuthSettingsHelper
+    from cesnet_openid_remote.remote_app import cesnet_remote_app
+
+    helper = CesnetOAuthSettingsHelper()
+    assert cesnet_remote_app() == helper.remote_app
+    assert cesnet_remote_app(rest=True) == helper.remote_rest_app
@@ -0,0 +1,107 @@
+from unittest.mock import Mock
+
+import pytest
+from flask import Flask
+
+from cesnet_openid_remote.communities import (
+    account_info_link_perun_groups,
+    get_user_perun_groups,
+)
+from cesnet_openid_remote.ext import CESNETOpenIDRemote
+from cesnet_openid_remote.signals import login_timed
+
+from .test_perun_groups import set_remote
+
+
+def test_login_timing_published(
+    app,
+    db,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_both,
+    monkeypatch,
+    search_clear,
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_METRICS", True)
+    remote = set_remote(return_userinfo_both, monkeypatch)
+    timings = []
+
+    def receiver(sender, timing):
+        timings.append(timing.as_dict())
+
+    with login_timed.connected_to(receiver, sender=app):
+        with app.test_request_context():
+            account_info_link_perun_groups(
+                remote,
+                account_info={"user": {"email": "curator@curator.org"}},
+            )
+
+    assert len(timings) == 1
+    timing = timings[0]
+    assert set(timing["phases"]) == {
+        "get_user_perun_groups",
+        "get_user_community_roles",
+        "get_mapped_communities",
+        "membership_writes",
+    }
+    assert timing["total"] >= sum(timing["phases"].values()) > 0
+    assert timing["counters"]["http_calls"] == 1
+    assert timing["counters"]["db_commits"] == 1
+    assert timing["counters"]["memberships_added"] == 1
+    assert timing["counters"]["memberships_removed"] == 0
+
+
+def test_login_timing_disabled(app, return_userinfo_both, monkeypatch):
+    remote = set_remote(return_userinfo_both, monkeypatch)
+    timings = []
+
+    def receiver(sender, timing):
+        timings.append(timing)
+
+    with login_timed.connected_to(receiver, sender=app):
+        with app.test_request_context():
+            get_user_perun_groups(remote)
+
+    assert timings == []
+
+
+def test_prometheus_sink_in_two_apps():
+    pytest.importorskip("prometheus_client")
+    from cesnet_openid_remote.metrics import PrometheusMetricsSink
+
+    # the UI and API applications are created in the same process
+    apps = [Flask(name) for name in ("ui", "api")]
+    for app in apps:
+        app.config["OAUTHCLIENT_CESNET_OPENID_METRICS_SINK"] = PrometheusMetricsSink
+        CESNETOpenIDRemote(app)
+
+    ui_sink, api_sink = (
+        app.extensions["cesnet-openid-remote"].metrics_sink for app in apps
+    )
+    ui_sink.increment("userinfo_fallbacks")
+    assert b'cesnet_openid_events_total{event="userinfo_fallbacks"} 1.0' in (
+        api_sink.export()
+    )
+
+
+def test_metrics_endpoint_requires_token(app, monkeypatch):
+    sink = Mock()
+    sink.export.return_value = b"metrics"
+    monkeypatch.setattr(app.extensions["cesnet-openid-remote"], "metrics_sink", sink)
+    url = "/cesnet-openid-remote/metrics"
+
+    with app.test_client() as client:
+        # disabled without a token
+        assert client.get(url).status_code == 404
+
+        monkeypatch.setitem(
+            app.config, "OAUTHCLIENT_CESNET_OPENID_METRICS_TOKEN", "secret"
+        )
+        assert client.get(url).status_code == 401
+        wrong = {"Authorization": "Bearer wrong"}
+        assert client.get(url, headers=wrong).status_code == 401
+
+        response = client.get(url, headers={"Authorization": "Bearer secret"})
+        assert response.status_code == 200
+        assert response.data == b"metrics"
+    sink.export.assert_called_once()
@@ -0,0 +1,84 @@
+import pytest
+
+from cesnet_openid_remote.communities import split_user_roles
+from cesnet_openid_remote.patterns import (
+    GroupMatcher,
+    match_mapping,
+    parse_group_pattern,
+    pattern_matches,
+)
+
+VO = "urn:geant:cesnet.cz:group:VO"
+
+
+def test_parse_group_pattern():
+    assert parse_group_pattern(f"{VO}#*") == (tuple(VO.split(":")), True)
+    assert parse_group_pattern(f"{VO}:*") == (tuple(VO.split(":")), False)
+    for pattern in [f"{VO}*", f"{VO}:*:sub#*", "#*", f"{VO}#perun#*"]:
+        with pytest.raises(ValueError):
+            parse_group_pattern(pattern)
+
+
+@pytest.mark.parametrize(
+    "aai_group,subtree,descendants",
+    [
+        (VO, True, False),
+        (f"{VO}#perun.cesnet.cz", True, False),
+        (f"{VO}:sub#perun.cesnet.cz", True, True),
+        (f"{VO}:sub:subsub#perun.cesnet.cz", True, True),
+        (f"{VO}2:sub#perun.cesnet.cz", False, False),
+        ("urn:geant:cesnet.cz:group:other#perun.cesnet.cz", False, False),
+    ],
+)
+def test_pattern_matches(aai_group, subtree, descendants):
+    assert pattern_matches(f"{VO}#*", aai_group) is subtree
+    assert pattern_matches(f"{VO}:*", aai_group) is descendants
+
+    matcher = GroupMatcher([(f"{VO}#*", "subtree"), (f"{VO}:*", "descendants")])
+    expected = {
+        name
+        for name, matched in [("subtree", subtree), ("descendants", descendants)]
+        if matched
+    }
+    assert set(matcher.match_group(aai_group)) == expected
+
+
+def test_group_matcher():
+    matcher = GroupMatcher(
+        [
+            (f"{VO}:sub#perun.cesnet.cz", "exact"),
+            (f"{VO}#*", "vo"),
+            (f"{VO}:sub#*", "sub"),
+            ("urn:geant:cesnet.cz:group:other#*", "other"),
+        ]
+    )
+    assert sorted(matcher.match([f"{VO}:sub#perun.cesnet.cz", "unmapped"])) == [
+        (f"{VO}:sub#perun.cesnet.cz", "exact"),
+        (f"{VO}:sub#perun.cesnet.cz", "sub"),
+        (f"{VO}:sub#perun.cesnet.cz", "vo"),
+    ]
+
+
+def test_match_mapping():
+    mapping = [
+        {"aai_group": f"{VO}:curators#perun.cesnet.cz", "role": "curator"},
+        {"aai_group": f"{VO}:*", "role": "reader"},
+    ]
+    assert match_mapping(mapping, {f"{VO}:members#perun.cesnet.cz"}) == [
+        {"aai_group": f"{VO}:members#perun.cesnet.cz", "role": "reader"}
+    ]
+
+
+def test_split_user_roles_with_pattern():
+    mapping = [{"aai_group": f"{VO}#*", "role": "reader"}]
+
+    assert split_user_roles(mapping, {"curator"}, {f"{VO}:sub#perun"}) == (
+        set(),
+        {"reader"},
+        {"curator"},
+    )
+    assert split_user_roles(mapping, {"reader"}, {"unmapped"}) == (
+        set(),
+        set(),
+        {"reader"},
+    )
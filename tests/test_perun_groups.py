@@ -1,18 +1,26 @@
+import copy
 import importlib
+import threading
 from unittest.mock import Mock
 
-import jwt
+import pytest
 from flask_login.utils import _create_identifier
 from invenio_access.permissions import system_identity
 from invenio_communities import current_communities
 from invenio_communities.members.records.api import Member
 from invenio_oauthclient.ext import InvenioOAuthClient
+from invenio_oauthclient.models import RemoteAccount
 from invenio_search.engine import dsl
 
+from cesnet_openid_remote import communities
 from cesnet_openid_remote.communities import (
     account_info_link_perun_groups,
     get_mapped_communities,
+    link_perun_groups,
 )
+from cesnet_openid_remote.ext import finalize_app
+from cesnet_openid_remote.mapping import get_mapping_version, load_community_mappings
+from cesnet_openid_remote.proxies import current_cesnet_openid
 
 # userinfo url 'https://login.cesnet.cz/oidc/'
 
@@ -85,6 +93,32 @@ def test_adding_groups(
     assert roles_after_repeat[0][1] == "curator"
 
 
+def test_adding_groups_in_task(
+    db,
+    app,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+):
+    # tasks run eagerly in tests (CELERY_TASK_ALWAYS_EAGER)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_SYNC_MODE", "task")
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+
+    account_info_link_perun_groups(
+        remote,
+        token=None,
+        response=None,
+        account_info={"user": {"email": "curator@curator.org"}},
+    )
+
+    roles_after = get_user_community_roles(user.id)
+    assert len(roles_after) == 1
+    assert roles_after[0][1] == "curator"
+
+
 def test_remove_groups(
     db,
     community_with_aai_mapping_cf,
@@ -168,6 +202,92 @@ def test_two_communities(
     assert len(roles_after_perun_deletion) == 0
 
 
+@pytest.mark.parametrize("concurrent_fetch", [False, True])
+def test_sync_skipped_when_fingerprint_matches(
+    db,
+    app,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    return_userinfo_noone,
+    concurrent_fetch,
+    monkeypatch,
+    search_clear,
+):
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_CONCURRENT_FETCH", concurrent_fetch
+    )
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+    RemoteAccount.create(user.id, remote.consumer_key, {"full_name": "curator"})
+
+    link_perun_groups(remote, user)
+    assert len(get_user_community_roles(user.id)) == 1
+
+    calls = []
+    original = communities.get_user_community_roles
+    monkeypatch.setattr(
+        communities,
+        "get_user_community_roles",
+        lambda user: calls.append(user) or original(user),
+    )
+    link_perun_groups(remote, user)
+    assert calls == []
+
+    link_perun_groups(remote, user, force=True)
+    assert len(calls) == 1
+
+    remote.get.side_effect = return_userinfo_noone
+    link_perun_groups(remote, user)
+    assert len(calls) == 2
+    assert len(get_user_community_roles(user.id)) == 0
+
+
+def test_mapping_change_recomputes_memberships(
+    db,
+    community_with_aai_mapping_cf,
+    community_service,
+    minimal_community,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+):
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+    community_id = community_with_aai_mapping_cf["id"]
+
+    link_perun_groups(remote, user)
+    assert get_user_community_roles(user.id) == [(community_id, "curator")]
+
+    # the recompute task runs eagerly in tests
+    minimal_community["custom_fields"]["aai_mapping"] = [
+        {"role": "reader", "aai_group": "test_community:curator"}
+    ]
+    community_service.update(system_identity, community_id, minimal_community)
+    assert get_user_community_roles(user.id) == [(community_id, "reader")]
+
+    minimal_community["custom_fields"]["aai_mapping"] = []
+    community_service.update(system_identity, community_id, minimal_community)
+    assert get_user_community_roles(user.id) == []
+
+
+def test_user_community_roles_not_paginated(
+    db, users, community_factory, minimal_community, location, search_clear
+):
+    user = users["reader"]
+    assert communities.get_user_community_roles(user) == {}
+    for i in range(12):
+        data = copy.deepcopy(minimal_community)
+        data["slug"] = f"community-{i}"
+        community = community_factory(users["owner"].identity, data)
+        communities.add_user_community_membership(community["id"], "reader", user)
+
+    roles = communities.get_user_community_roles(user)
+    assert len(roles) == 12
+    assert all(r == {"reader"} for r in roles.values())
+
+
 def test_aai_mapping_group_facet(
     db, community_with_aai_mapping_cf, community2_with_aai_mapping_cf, search_clear
 ):
@@ -180,6 +300,119 @@ def test_aai_mapping_group_facet(
     assert len(mapped_communities) == 1
 
 
+def test_load_community_mappings(
+    db, community_with_aai_mapping_cf, aai_mapping_example_dict, search_clear
+):
+    assert list(load_community_mappings()) == [
+        (community_with_aai_mapping_cf["id"], aai_mapping_example_dict)
+    ]
+
+
+@pytest.mark.parametrize("mapping_index", [False, True])
+def test_mapping_updated_on_community_update(
+    db,
+    app,
+    community_with_aai_mapping_cf,
+    community_service,
+    minimal_community,
+    mapping_index,
+    monkeypatch,
+    search_clear,
+):
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX", mapping_index
+    )
+    community_id = community_with_aai_mapping_cf["id"]
+    assert list(get_mapped_communities({"test_community:curator"})) == [community_id]
+
+    minimal_community["custom_fields"]["aai_mapping"] = [
+        {"role": "reader", "aai_group": "test_community:reader"}
+    ]
+    community_service.update(system_identity, community_id, minimal_community)
+
+    assert get_mapped_communities({"test_community:curator"}) == {}
+    assert get_mapped_communities({"test_community:reader"}) == {
+        community_id: [{"aai_group": "test_community:reader", "role": "reader"}]
+    }
+
+
+def test_mapping_index_warmup(
+    db, app, community_with_aai_mapping_cf, monkeypatch, search_clear
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX", True)
+    mapping_index = current_cesnet_openid.mapping_index
+    mapping_index.invalidate()
+
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_WARMUP_MAX_ENTRIES", 0
+    )
+    finalize_app(app)
+    assert mapping_index.is_stale(get_mapping_version())
+
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX_WARMUP_MAX_ENTRIES", None
+    )
+    finalize_app(app)
+    assert not mapping_index.is_stale(get_mapping_version())
+
+
+def test_mapping_index_rebuild_does_not_block(
+    db, app, community_with_aai_mapping_cf, monkeypatch, search_clear
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX", True)
+    mapping_index = current_cesnet_openid.mapping_index
+    mapping_index.invalidate()
+    community_id = community_with_aai_mapping_cf["id"]
+
+    # another thread is rebuilding the index, the lookup queries the table
+    with mapping_index._lock:
+        assert get_mapped_communities({"test_community:curator"}) == {
+            community_id: [{"aai_group": "test_community:curator", "role": "curator"}]
+        }
+        assert mapping_index.is_stale(get_mapping_version())
+
+
+@pytest.mark.parametrize("mapping_index", [False, True])
+def test_pattern_mapping(
+    db,
+    app,
+    community_with_aai_mapping_cf,
+    community_service,
+    minimal_community,
+    users,
+    mapping_index,
+    monkeypatch,
+    search_clear,
+):
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_MAPPING_INDEX", mapping_index
+    )
+    remote = set_remote(
+        lambda url: Mock(
+            data={"eduperson_entitlement": ["urn:test:VO:sub#perun.cesnet.cz"]}
+        ),
+        monkeypatch,
+    )
+    user = users["reader"]
+    community_id = community_with_aai_mapping_cf["id"]
+
+    link_perun_groups(remote, user)
+    assert get_user_community_roles(user.id) == []
+
+    # the recompute task finds the user by the pattern
+    minimal_community["custom_fields"]["aai_mapping"] = [
+        {"role": "reader", "aai_group": "urn:test:VO#*"}
+    ]
+    community_service.update(system_identity, community_id, minimal_community)
+    assert get_user_community_roles(user.id) == [(community_id, "reader")]
+    assert get_mapped_communities({"urn:test:VO:sub#perun.cesnet.cz"}) == {
+        community_id: [
+            {"aai_group": "urn:test:VO:sub#perun.cesnet.cz", "role": "reader"}
+        ]
+    }
+    assert get_mapped_communities({"urn:test:VO2#perun.cesnet.cz"}) == {}
+
+
 class MockSerializer:
     def loads(self, token):
         return {
@@ -211,6 +444,8 @@ def test_user_unregistered(
     monkeypatch,
     client,
     search_clear,
+    local_jwks,
+    sign_id_token,
 ):
     InvenioOAuthClient(app)
     module = importlib.import_module("invenio_oauthclient.views.client")
@@ -223,7 +458,9 @@ def test_user_unregistered(
         module, "oauth_get_user", lambda a, account_info, access_token: None
     )
     monkeypatch.setattr(
-        module, "get_user_perun_groups", lambda x: ["test_community:curator"]
+        module,
+        "get_user_perun_groups",
+        lambda remote, sub=None, claims=None: ["test_community:curator"],
     )
 
     from flask_oauthlib.client import OAuthRemoteApp
@@ -236,10 +473,49 @@ def test_user_unregistered(
             "token_type": "Bearer",
             "expires_in": 3599,
             "scope": "lalala",
-            "id_token": jwt.encode(id_token_unregistered, ""),
+            "id_token": sign_id_token(id_token_unregistered),
         },
     )
     res = client.get("/oauth/authorized/eduid/?code=dxuW0cqdD2CW&state=eyJhbGci")
     user_id = len(users) + 1
     roles = get_user_community_roles(user_id)
     assert len(roles) == 1
+
+
+def test_concurrent_fetch(
+    app,
+    db,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+):
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+    link_perun_groups(remote, user.user)
+
+    # each call waits for the other one, so they must run at the same time
+    both_running = threading.Barrier(2, timeout=5)
+
+    def overlapping_userinfo(url):
+        both_running.wait()
+        return return_userinfo_curator(url)
+
+    get_roles = communities.get_user_community_roles
+
+    def overlapping_user_community_roles(user):
+        both_running.wait()
+        return get_roles(user)
+
+    monkeypatch.setattr(
+        communities, "get_user_community_roles", overlapping_user_community_roles
+    )
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_CONCURRENT_FETCH", True)
+    remote.get.side_effect = overlapping_userinfo
+
+    with app.test_request_context():
+        plan = link_perun_groups(remote, user.user)
+    assert not both_running.broken
+    assert remote.get.call_count == 2
+    assert plan is not None and not plan.add and not plan.remove
@@ -0,0 +1,121 @@
+import os
+import pstats
+
+from cesnet_openid_remote.communities import link_perun_groups
+from cesnet_openid_remote.profiling import (
+    CProfileSampler,
+    current_profile,
+    rotate_profiles,
+)
+
+from .test_perun_groups import set_remote
+
+
+def test_slow_login_profiled(
+    app,
+    db,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+    tmp_path,
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_THRESHOLD", 0)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_DIR", tmp_path)
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+
+    with app.test_request_context():
+        link_perun_groups(remote, user.user)
+
+    (profile,) = os.listdir(tmp_path)
+    assert "-e1-c1-" in profile
+    assert f"-u{user.id}-" not in profile
+    stats = pstats.Stats(str(tmp_path / profile))
+    assert any(name == "sync_user_perun_groups" for _, _, name in stats.stats.keys())
+
+
+def test_fast_login_not_kept(
+    app, users, return_userinfo_curator, monkeypatch, tmp_path
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_THRESHOLD", 60)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_DIR", tmp_path)
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    monkeypatch.setattr(
+        "cesnet_openid_remote.communities.sync_perun_groups", lambda *a, **kw: None
+    )
+
+    with app.test_request_context():
+        link_perun_groups(remote, users["curator"].user)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_rotate_profiles(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"login-{i}.prof"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (i, i))
+
+    rotate_profiles(tmp_path, 250)
+
+    assert sorted(os.listdir(tmp_path)) == ["login-3.prof", "login-4.prof"]
+
+
+def test_overlapping_logins_profiled_once(
+    app,
+    db,
+    community_with_aai_mapping_cf,
+    users,
+    return_userinfo_curator,
+    monkeypatch,
+    search_clear,
+    tmp_path,
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_THRESHOLD", 0)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_DIR", tmp_path)
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+
+    with app.test_request_context():
+        # the first login is being profiled
+        profile = current_profile()
+        with profile.profile():
+            with app.test_request_context():
+                assert current_profile() is None
+                link_perun_groups(remote, user.user)
+    assert len(os.listdir(tmp_path)) == 1
+
+    # the profiler is free again
+    with app.test_request_context():
+        link_perun_groups(remote, user.user)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_login_not_profiled_when_profiler_fails(
+    app, users, return_userinfo_curator, monkeypatch, tmp_path
+):
+    class BusyProfiler(CProfileSampler):
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_SAMPLE_RATE", 1)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_THRESHOLD", 0)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILE_DIR", tmp_path)
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_PROFILER", BusyProfiler)
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    synced = []
+    monkeypatch.setattr(
+        "cesnet_openid_remote.communities.sync_perun_groups",
+        lambda *a, **kw: synced.append(True),
+    )
+
+    with app.test_request_context():
+        link_perun_groups(remote, users["curator"].user)
+
+    assert synced == [True]
+    assert os.listdir(tmp_path) == []
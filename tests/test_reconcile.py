@@ -0,0 +1,67 @@
+import io
+import json
+
+import pytest
+from invenio_accounts.models import UserIdentity
+from invenio_communities.members.records.api import Member
+
+from cesnet_openid_remote.communities import get_user_community_roles
+from cesnet_openid_remote.reconcile import Checkpoint, read_export, reconcile_export
+
+
+def test_read_export():
+    jsonl = io.StringIO(
+        '{"sub": "a", "eduperson_entitlement": ["g1", "g2"]}\n\n{"sub": "b"}\n'
+    )
+    assert list(read_export(jsonl)) == [("a", ["g1", "g2"]), ("b", [])]
+
+    csv = io.StringIO("sub,eduperson_entitlement\na,g1;g2\nb,\n")
+    assert list(read_export(csv, "csv")) == [("a", ["g1", "g2"]), ("b", [])]
+
+
+@pytest.mark.parametrize("engine", ["python", "batch"])
+def test_reconcile_export(
+    db, community_with_aai_mapping_cf, users, tmp_path, engine, search_clear
+):
+    curator, reader = users["curator"], users["reader"]
+    UserIdentity.create(curator.user, "perun", "curator-sub")
+    UserIdentity.create(reader.user, "perun", "reader-sub")
+    db.session.commit()
+
+    export = io.StringIO(
+        "\n".join(
+            json.dumps(entry)
+            for entry in [
+                {
+                    "sub": "curator-sub",
+                    "eduperson_entitlement": ["test_community:curator"],
+                },
+                {
+                    "sub": "unknown-sub",
+                    "eduperson_entitlement": ["test_community:curator"],
+                },
+                {"sub": "reader-sub", "eduperson_entitlement": []},
+            ]
+        )
+    )
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+
+    stats = reconcile_export(
+        read_export(export), chunk_size=2, checkpoint=checkpoint, engine=engine
+    )
+    Member.index.refresh()
+
+    assert stats["users"] == 3
+    assert stats["unknown"] == 1
+    assert stats["added"] == 1
+    assert stats["removed"] == 0
+    assert stats["failures"] == 0
+    assert get_user_community_roles(curator) == {
+        community_with_aai_mapping_cf["id"]: {"curator"}
+    }
+    assert Checkpoint(checkpoint.path).offset == 3
+
+    # everything has been reconciled already
+    export.seek(0)
+    stats = reconcile_export(read_export(export), checkpoint=checkpoint)
+    assert stats["users"] == 0
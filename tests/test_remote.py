@@ -0,0 +1,29 @@
+from invenio_accounts.models import UserIdentity
+
+from cesnet_openid_remote.remote import autocreate_user
+
+
+def test_autocreate_user(app, db, monkeypatch):
+    commits = []
+    commit = db.session.commit
+    monkeypatch.setattr(db.session, "commit", lambda: commits.append(1) or commit())
+    account_info = {
+        "external_id": "new-sub",
+        "external_method": "perun",
+        "user": {"email": "New@example.org", "profile": {"full_name": "New User"}},
+    }
+
+    autocreate_user(None, account_info=account_info)
+    identity = UserIdentity.query.filter_by(id="new-sub", method="perun").one()
+    assert identity.user.email == "new@example.org"
+    assert identity.user.confirmed_at is not None
+    assert len(commits) == 1
+
+    # nothing changed, nothing written
+    autocreate_user(None, account_info=account_info)
+    assert len(commits) == 1
+
+    account_info["user"]["profile"]["full_name"] = "Renamed User"
+    autocreate_user(None, account_info=account_info)
+    assert len(commits) == 2
+    assert identity.user.user_profile["full_name"] == "Renamed User"
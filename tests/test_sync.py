@@ -0,0 +1,223 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from cesnet_openid_remote import communities, tasks
+from cesnet_openid_remote.communities import plan_user_sync
+from cesnet_openid_remote.sync import SyncCoordinator, sync_fingerprint
+
+from .test_perun_groups import set_remote
+
+
+def test_sync_runs_once_per_request(app):
+    coordinator = SyncCoordinator()
+    user = Mock(id=1)
+    calls = []
+
+    def sync():
+        calls.append(user.id)
+        return len(calls)
+
+    with app.test_request_context():
+        assert coordinator.run(user, sync) == 1
+        assert coordinator.run(user, sync) == 1
+        assert coordinator.run(Mock(id=2), sync) == 2
+
+    with app.test_request_context():
+        assert coordinator.run(user, sync) == 3
+
+    assert coordinator.stats["runs"] == 3
+    assert coordinator.stats["reused"] == 1
+
+
+def test_sync_runs_always_outside_request(app):
+    coordinator = SyncCoordinator()
+    user = Mock(id=1)
+
+    coordinator.run(user, lambda: None)
+    coordinator.run(user, lambda: None)
+
+    assert coordinator.stats["runs"] == 2
+    assert coordinator.stats["reused"] == 0
+
+
+def test_concurrent_syncs_coalesced(app, db, users, monkeypatch):
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_SYNC_ADVISORY_LOCK", True
+    )
+    coordinator = SyncCoordinator()
+    user = Mock(id=users["curator"].id)
+    started = threading.Event()
+    calls = []
+    results = []
+
+    def sync():
+        calls.append(user.id)
+        started.set()
+        time.sleep(0.2)
+        return "plan"
+
+    def login():
+        with app.app_context():
+            results.append(coordinator.run(user, sync))
+
+    threads = [threading.Thread(target=login) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [user.id]
+    assert results == ["plan"] * 5
+    assert coordinator.stats["runs"] == 1
+    assert coordinator.stats["coalesced"] == 4
+
+
+def test_concurrent_syncs_error_shared(app):
+    coordinator = SyncCoordinator()
+    user = Mock(id=1)
+    started = threading.Event()
+    errors = []
+
+    def sync():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("sync failed")
+
+    def login():
+        with app.app_context():
+            try:
+                coordinator.run(user, sync)
+            except ValueError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=login) for _ in range(3)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert coordinator.stats["runs"] == 1
+
+
+def test_syncs_of_different_users_not_serialized(app):
+    coordinator = SyncCoordinator()
+    # each sync waits for the other two, serialized syncs break the barrier
+    barrier = threading.Barrier(3, timeout=5)
+    errors = []
+
+    def login(user_id):
+        with app.app_context():
+            try:
+                coordinator.run(Mock(id=user_id), barrier.wait)
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=login, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert coordinator.stats["runs"] == 3
+
+
+def test_plan_user_sync():
+    communities = {
+        "new": [{"aai_group": "new:curator", "role": "curator"}],
+        "kept": [{"aai_group": "kept:reader", "role": "reader"}],
+        "changed": [
+            {"aai_group": "changed:curator", "role": "curator"},
+            {"aai_group": "changed:reader", "role": "reader"},
+        ],
+        "conflict": [
+            {"aai_group": "conflict:curator", "role": "curator"},
+            {"aai_group": "conflict:reader", "role": "reader"},
+        ],
+    }
+    perun_groups = {
+        "new:curator",
+        "kept:reader",
+        "changed:curator",
+        "conflict:curator",
+        "conflict:reader",
+    }
+    current_roles = {
+        "kept": {"reader"},
+        "changed": {"reader"},
+        "gone": {"curator"},
+    }
+
+    plan = plan_user_sync(current_roles, perun_groups, communities)
+
+    assert sorted(plan.add) == [("changed", "curator"), ("new", "curator")]
+    assert sorted(plan.remove) == ["changed", "gone"]
+    assert plan.conflicts == {"conflict": {"curator", "reader"}}
+    # the input is not modified
+    assert "gone" in current_roles
+
+
+def test_task_sync_last_write_wins(app, db, users, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(
+        tasks.sync_perun_groups_task,
+        "delay",
+        lambda *args, **kwargs: scheduled.append((args, kwargs)),
+    )
+    synced = []
+    monkeypatch.setattr(
+        communities,
+        "sync_user_perun_groups",
+        lambda user, perun_groups, client_id, force, stale: synced.append(perun_groups),
+    )
+    user = users["curator"]
+
+    tasks.schedule_perun_groups_sync(user, {"first"})
+    tasks.schedule_perun_groups_sync(user, {"second"})
+    for args, kwargs in scheduled:
+        tasks.sync_perun_groups_task(*args, **kwargs)
+
+    assert synced == [{"second"}]
+
+
+def test_task_sync_newest_login_wins(
+    app, db, users, return_userinfo_curator, return_userinfo_noone, monkeypatch
+):
+    monkeypatch.setitem(app.config, "OAUTHCLIENT_CESNET_OPENID_SYNC_MODE", "task")
+    scheduled = []
+    monkeypatch.setattr(
+        tasks.sync_perun_groups_task,
+        "delay",
+        lambda *args, **kwargs: scheduled.append((args, kwargs)),
+    )
+    synced = []
+    monkeypatch.setattr(
+        communities,
+        "sync_user_perun_groups",
+        lambda user, perun_groups, client_id, force, stale: synced.append(perun_groups),
+    )
+    remote = set_remote(return_userinfo_curator, monkeypatch)
+    user = users["curator"]
+    # login A has been synced
+    synced_fingerprint = sync_fingerprint({"test_community:curator"})
+    monkeypatch.setattr(
+        communities,
+        "is_synced",
+        lambda remote_account, fingerprint: fingerprint == synced_fingerprint,
+    )
+
+    # login B queues a task, login A again must queue one too
+    remote.get.side_effect = return_userinfo_noone
+    communities.sync_perun_groups(remote, user)
+    remote.get.side_effect = return_userinfo_curator
+    communities.sync_perun_groups(remote, user)
+    for args, kwargs in scheduled:
+        tasks.sync_perun_groups_task(*args, **kwargs)
+
+    assert synced == [{"test_community:curator"}]
@@ -0,0 +1,58 @@
+from unittest.mock import Mock
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from cesnet_openid_remote.proxies import current_cesnet_openid
+from cesnet_openid_remote.tokens import decode_id_token
+
+remote = Mock(consumer_key="lalala")
+
+
+def test_id_token_verified_once(app, local_jwks, sign_id_token):
+    resp = {"id_token": sign_id_token({"sub": "user1"})}
+
+    with app.test_request_context():
+        claims = decode_id_token(remote, resp)
+        assert decode_id_token(remote, resp) is claims
+    assert claims["sub"] == "user1"
+
+    with app.test_request_context():
+        decode_id_token(remote, resp)
+
+    assert len(local_jwks) == 1
+    assert current_cesnet_openid.jwks.stats["hits"] == 2
+    assert current_cesnet_openid.jwks.stats["misses"] == 0
+
+
+def test_id_token_invalid_signature(app, local_jwks, sign_id_token):
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    resp = {"id_token": sign_id_token({"sub": "user1"}, key=other_key)}
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        decode_id_token(remote, resp)
+
+
+def test_id_token_invalid_audience(app, local_jwks, sign_id_token):
+    resp = {"id_token": sign_id_token({"sub": "user1", "aud": "someone-else"})}
+
+    with pytest.raises(jwt.InvalidAudienceError):
+        decode_id_token(remote, resp)
+
+
+def test_unknown_key_refreshes_key_set(app, local_jwks, sign_id_token, monkeypatch):
+    resp = {"id_token": sign_id_token({"sub": "user1"}, kid="rotated")}
+
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_id_token(remote, resp)
+    # the key set has just been downloaded, it is not downloaded again
+    assert len(local_jwks) == 1
+
+    monkeypatch.setitem(
+        app.config, "OAUTHCLIENT_CESNET_OPENID_JWKS_MIN_REFRESH_INTERVAL", -1
+    )
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_id_token(remote, resp)
+    assert len(local_jwks) == 2
+    assert current_cesnet_openid.jwks.stats["misses"] == 2